@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+from django.core.exceptions import ImproperlyConfigured
 from pathlib import Path
 import dj_database_url
 import environ  # Pylance does not recognize this import for some reason but the dev server runs perfectly
@@ -29,6 +30,80 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = env('SECRET_KEY')
 
+# Passphrase for the CryptoJS compatible payload envelope
+PAYLOAD_SECRET = env('PAYLOAD_SECRET')
+
+# Negotiate a per-session payload key at login, old clients keep using PAYLOAD_SECRET
+PAYLOAD_SESSION_KEYS = env.bool('PAYLOAD_SESSION_KEYS', default=True)
+
+# Request bodies above this size are rejected before being decrypted
+PAYLOAD_MAX_BODY_BYTES = env.int('PAYLOAD_MAX_BODY_BYTES', default=2 * 1024 * 1024)
+
+# Retry malformed payloads with the legacy best-effort parser (counted in metrics)
+PAYLOAD_LENIENT_PARSING = env.bool('PAYLOAD_LENIENT_PARSING', default=True)
+
+# Responses above this size are compressed before encryption for clients sending X-Payload-Accept-Encoding
+PAYLOAD_COMPRESSION_THRESHOLD = env.int('PAYLOAD_COMPRESSION_THRESHOLD', default=1024)
+PAYLOAD_BROTLI_QUALITY = env.int('PAYLOAD_BROTLI_QUALITY', default=5)
+PAYLOAD_ZLIB_LEVEL = env.int('PAYLOAD_ZLIB_LEVEL', default=6)
+
+# Under ASGI, responses estimated above this size are rendered and encrypted on a bounded thread pool
+PAYLOAD_OFFLOAD_THRESHOLD = env.int('PAYLOAD_OFFLOAD_THRESHOLD', default=256 * 1024)
+PAYLOAD_OFFLOAD_WORKERS = env.int('PAYLOAD_OFFLOAD_WORKERS', default=4)
+# Renders beyond this many queued jobs run inline
+PAYLOAD_OFFLOAD_MAX_QUEUE = env.int('PAYLOAD_OFFLOAD_MAX_QUEUE', default=64)
+
+# Password hashing runs on its own pool, requests get a 503 when it is full or they waited too long
+PASSWORD_HASHING_WORKERS = env.int('PASSWORD_HASHING_WORKERS', default=2)
+PASSWORD_HASHING_MAX_QUEUE = env.int('PASSWORD_HASHING_MAX_QUEUE', default=32)
+PASSWORD_HASHING_QUEUE_TIMEOUT = env.float('PASSWORD_HASHING_QUEUE_TIMEOUT', default=2.0)
+
+# 'session' (cookie sessions), 'token' (signed bearer tokens, no session) or 'both'
+AUTH_MODE = env('AUTH_MODE', default='session')
+JWT_ALGO = env('JWT_ALGO', default='HS256')
+JWT_SECRET = env('JWT_SECRET', default=SECRET_KEY)
+# Lifetime of access tokens, refresh tokens live JWT_REFRESH_VALIDATION_SECONDS
+JWT_VALIDATION_SECONDS = env.int('JWT_VALIDATION_SECONDS', default=900)
+JWT_REFRESH_VALIDATION_SECONDS = env.int('JWT_REFRESH_VALIDATION_SECONDS', default=14 * 24 * 3600)
+# Revoked tokens are reloaded from the database this often by each process
+JWT_DENYLIST_REFRESH_SECONDS = env.int('JWT_DENYLIST_REFRESH_SECONDS', default=30)
+
+# Verification OTPs and reset password links expire after these many seconds
+OTP_VALIDATION_SECONDS = env.int('OTP_VALIDATION_SECONDS', default=24 * 3600)
+FORGOT_PASS_VALIDATION_SECONDS = env.int('FORGOT_PASS_VALIDATION_SECONDS', default=3600)
+# Expired rows (unverified accounts, reset links, revoked tokens) are deleted by reap_expired after this long,
+# unverified accounts can still ask for a new OTP until then
+EXPIRED_ROWS_RETENTION_SECONDS = env.int('EXPIRED_ROWS_RETENTION_SECONDS', default=7 * 24 * 3600)
+REAPER_BATCH_SIZE = env.int('REAPER_BATCH_SIZE', default=500)
+
+# Username search (users.search): in-process prefix index, rebuilt this often from the database
+USER_SEARCH_INDEX = env.bool('USER_SEARCH_INDEX', default=True)
+USER_SEARCH_REFRESH_SECONDS = env.int('USER_SEARCH_REFRESH_SECONDS', default=300)
+USER_SEARCH_DEFAULT_LIMIT = 10
+USER_SEARCH_MAX_LIMIT = 50
+
+# In-process graph of team members and invites (teams.graph)
+TEAM_GRAPH = env.bool('TEAM_GRAPH', default=True)
+TEAM_GRAPH_REFRESH_SECONDS = env.int('TEAM_GRAPH_REFRESH_SECONDS', default=60)
+
+# Large read-only listings are built from values() rows by compiled serializers (common.compiled)
+COMPILED_SERIALIZERS = env.bool('COMPILED_SERIALIZERS', default=True)
+
+# In-process Bloom filter answering /api/auth/availability for values never registered, without the database
+AVAILABILITY_BLOOM_FILTER = env.bool('AVAILABILITY_BLOOM_FILTER', default=True)
+AVAILABILITY_BLOOM_CAPACITY = env.int('AVAILABILITY_BLOOM_CAPACITY', default=100000)
+AVAILABILITY_BLOOM_ERROR_RATE = env.float('AVAILABILITY_BLOOM_ERROR_RATE', default=0.01)
+# Rebuilt from the database this often, picking up accounts registered by other processes
+AVAILABILITY_BLOOM_REFRESH_SECONDS = env.int('AVAILABILITY_BLOOM_REFRESH_SECONDS', default=300)
+
+# Key of the permutation behind profile tags and team ids (common.ids), never change it once set
+ID_ALLOCATOR_SECRET = env('ID_ALLOCATOR_SECRET', default=SECRET_KEY)
+# Sequence numbers reserved per process at once
+ID_BLOCK_SIZE = env.int('ID_BLOCK_SIZE', default=100)
+
+# Maximum number of sub-requests accepted by /api/batch
+BATCH_MAX_OPERATIONS = env.int('BATCH_MAX_OPERATIONS', default=10)
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = is_dev
 
@@ -58,6 +133,7 @@ INSTALLED_APPS = [
     'teams',
     'contests',
     'invites',
+    'outbox',
 ]
 
 MIDDLEWARE = [
@@ -67,13 +143,20 @@ MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'common.middleware.AuthSnapshotMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'common.middleware.OffloadRenderMiddleware',
 ]
 
 REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'users_auth.authentication.JWTAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
     'DEFAULT_PARSER_CLASSES': [
         'common.parsers.CryptoParser',
     ],
@@ -132,7 +215,11 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'x-payload-key-id',
+    'x-payload-encoding',
+    'x-payload-accept-encoding',
 ]
+CORS_EXPOSE_HEADERS = ['x-payload-encoding']
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
@@ -143,6 +230,49 @@ DATABASES = {
     'default': dj_database_url.parse(env('DB_URL'))
 }
 
+# locmemcache:// (per process) or filecache:///path stand in for a shared cache in development and tests
+CACHES = {
+    # Room for a version per cached user, team and contest representation (common.representations)
+    'default': env.cache('CACHE_URL', default='locmemcache://?max_entries=100000')
+}
+# Per-process backends cannot carry invalidations to the other processes
+SHARED_CACHE = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Serialized users, teams and contests reused until one of their rows changes (common.representations).
+# Invalidations go through CACHES, on by default only when every process shares it
+REPRESENTATION_CACHE = env.bool('REPRESENTATION_CACHE', default=SHARED_CACHE)
+REPRESENTATION_CACHE_ALIAS = 'default'
+REPRESENTATION_CACHE_SIZE = env.int('REPRESENTATION_CACHE_SIZE', default=20000)
+# Bounds how long a representation built from rows read during a concurrent update can be served
+REPRESENTATION_CACHE_TTL = env.int('REPRESENTATION_CACHE_TTL', default=300)
+# Bounds how long rows changed by another process can still be served from here
+REPRESENTATION_VERSION_TTL = env.int('REPRESENTATION_VERSION_TTL', default=5)
+
+# Sessions are read through a per-process LRU, and through CACHES when SESSION_SHARED_CACHE is set
+SESSION_ENGINE = 'common.sessions'
+SESSION_CACHE_ALIAS = 'default'
+SESSION_SHARED_CACHE = env.bool('SESSION_SHARED_CACHE', default=False)
+SESSION_LOCAL_CACHE_SIZE = env.int('SESSION_LOCAL_CACHE_SIZE', default=10000)
+# Bounds how long a session deleted by another process can still be used here
+SESSION_LOCAL_CACHE_TTL = env.int('SESSION_LOCAL_CACHE_TTL', default=5)
+
+# request.user and its profile are served from a snapshot in CACHES, dropped when either row is saved.
+# Every process has to see the invalidations, so a shared cache is required
+AUTH_SNAPSHOT = env.bool('AUTH_SNAPSHOT', default=SHARED_CACHE)
+AUTH_SNAPSHOT_CACHE_ALIAS = 'default'
+AUTH_SNAPSHOT_TTL = env.int('AUTH_SNAPSHOT_TTL', default=300)
+
+if AUTH_SNAPSHOT and not SHARED_CACHE:
+    raise ImproperlyConfigured('AUTH_SNAPSHOT needs a shared CACHE_URL')
+
+# Session updates that keep the same user are written to the database in the background
+SESSION_WRITE_BEHIND = env.bool('SESSION_WRITE_BEHIND', default=False)
+SESSION_WRITE_BEHIND_INTERVAL = env.float('SESSION_WRITE_BEHIND_INTERVAL', default=5.0)
+SESSION_WRITE_BEHIND_MAX_PENDING = env.int('SESSION_WRITE_BEHIND_MAX_PENDING', default=1000)
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
@@ -163,3 +293,18 @@ EMAIL_PORT = env('EMAIL_PORT')
 EMAIL_HOST_USER = env('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = env('EMAIL_HOST_PASSWORD')
 EMAIL_USE_TLS = True
+EMAIL_BACKEND = env('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
+EMAIL_TIMEOUT = env.int('EMAIL_TIMEOUT', default=30)
+
+# Transactional mails are stored in the outbox and delivered by `manage.py send_outbox`
+OUTBOX_BATCH_SIZE = env.int('OUTBOX_BATCH_SIZE', default=50)
+OUTBOX_MAX_ATTEMPTS = env.int('OUTBOX_MAX_ATTEMPTS', default=8)
+# Retries wait OUTBOX_RETRY_BACKOFF_SECONDS * 2^(attempts - 1), capped at OUTBOX_MAX_BACKOFF_SECONDS
+OUTBOX_RETRY_BACKOFF_SECONDS = env.int('OUTBOX_RETRY_BACKOFF_SECONDS', default=30)
+OUTBOX_MAX_BACKOFF_SECONDS = env.int('OUTBOX_MAX_BACKOFF_SECONDS', default=3600)
+# Invite mails are merged per recipient, a digest goes out once the oldest pending invite is this old
+INVITE_DIGEST_WINDOW_SECONDS = env.int('INVITE_DIGEST_WINDOW_SECONDS', default=900)
+# Authenticated SMTP connections kept open by each worker, recycled after a maximum age or message count
+OUTBOX_SMTP_POOL_SIZE = env.int('OUTBOX_SMTP_POOL_SIZE', default=2)
+OUTBOX_SMTP_MAX_AGE_SECONDS = env.int('OUTBOX_SMTP_MAX_AGE_SECONDS', default=300)
+OUTBOX_SMTP_MAX_MESSAGES = env.int('OUTBOX_SMTP_MAX_MESSAGES', default=100)
@@ -3,6 +3,7 @@ from django.urls import path, include
 
 urlpatterns = [
     # path('admin', admin.site.urls),
+    path('api', include('common.urls')),
     path('api/auth', include('users_auth.urls')),
     path('api/users', include('users.urls')),
     path('api/teams', include('teams.urls')),
@@ -0,0 +1,238 @@
+"""
+Compiled read-only serializers for large listings.
+
+A CompiledSerializer takes the field tree of a model serializer once and turns it into
+a values_list() query over the columns that tree reads, one more query per nested list,
+and a row -> dict function generated for that spec. Rows come out exactly as the
+serializer's to_representation() builds them, same keys in the same order, without
+creating or running DRF fields per row.
+
+Supported are model fields, single related objects serialized by a nested model
+serializer or as their primary key, reverse foreign keys serialized as nested lists,
+and FlattenedModelSerializer. Anything else (method fields, sources through properties
+or dotted paths, many to many relations) raises NotCompilable on first use.
+
+COMPILED_SERIALIZERS=False serves the same listings through the serializer itself.
+"""
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import QuerySet
+from itertools import islice
+from rest_framework import fields
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.serializers import ListSerializer, ModelSerializer, Serializer, SerializerMethodField
+from threading import Lock
+from .serializers import CachedRepresentationMixin, FlattenedModelSerializer, planned
+
+# Fields whose to_representation() returns the value read from the database as it is
+PASSTHROUGH_FIELDS = (
+    fields.CharField, fields.EmailField, fields.SlugField, fields.URLField,
+    fields.IntegerField, fields.BooleanField, fields.ReadOnlyField,
+)
+
+
+class NotCompilable(Exception):
+    pass
+
+
+class Plan:
+    """ Columns read from one model and the function building a representation out of a row """
+
+    def __init__(self, serializer: ModelSerializer, model, group_by: str = None):
+        self.model = model
+        self.group_by = group_by
+        self.columns = []
+        self.nested = []  # (index of the owner primary key, plan of the nested list)
+        self._indexes = {}
+        self._namespace = {}
+
+        pairs = self.representation(serializer, model, '')
+        self.key_index = self.column(group_by) if group_by is not None else None
+
+        source = f'def build(row, lists):\n    return {literal(pairs)}\n'
+        exec(compile(source, f'<compiled {type(serializer).__name__}>', 'exec'), self._namespace)
+        self.build = self._namespace['build']
+
+    def column(self, path: str) -> int:
+        if path not in self._indexes:
+            self._indexes[path] = len(self.columns)
+            self.columns.append(path)
+
+        return self._indexes[path]
+
+    def representation(self, serializer, model, prefix: str) -> dict:
+        """ Output key -> expression over row and lists, in the order to_representation() sets them """
+        # Cached representations are the ones the serializer builds
+        method = next(
+            klass.__dict__['to_representation'] for klass in type(serializer).__mro__
+            if 'to_representation' in klass.__dict__ and klass is not CachedRepresentationMixin
+        )
+
+        if method is not Serializer.to_representation and method is not FlattenedModelSerializer.to_representation:
+            raise NotCompilable(f'{type(serializer).__name__} overrides to_representation()')
+
+        pairs, nested_pairs = {}, {}
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+
+            source = field.source
+
+            if isinstance(field, SerializerMethodField) or source == '*' or '.' in source:
+                raise NotCompilable(f'{name} does not read a model field')
+
+            try:
+                model_field = model._meta.get_field(source)
+            except FieldDoesNotExist:
+                raise NotCompilable(f'{name} reads {source}, which is not a field of {model.__name__}')
+
+            many = isinstance(field, ListSerializer)
+            nested = field.child if many else field
+
+            if not model_field.is_relation:
+                pairs[name] = self.value(field, prefix + source)
+            elif isinstance(nested, ModelSerializer) and many and model_field.one_to_many:
+                owner = self.column(prefix + model._meta.pk.name)
+                self.nested.append((owner, Plan(nested, model_field.related_model, model_field.field.name)))
+                pairs[name] = f'(lists[{len(self.nested) - 1}].get(row[{owner}]) or [])'
+            elif isinstance(nested, ModelSerializer) and not many and (model_field.many_to_one or model_field.one_to_one):
+                related = model_field.related_model
+                child = self.representation(nested, related, f'{prefix}{source}__')
+                pk = self.column(f'{prefix}{source}__{related._meta.pk.name}')
+                pairs[name] = f'(None if row[{pk}] is None else {literal(child)})'
+                nested_pairs[name] = child
+            elif (type(field) is PrimaryKeyRelatedField and field.pk_field is None
+                  and model_field.many_to_one and model_field.concrete):
+                pairs[name] = f'row[{self.column(prefix + source)}]'
+            else:
+                raise NotCompilable(f'{name} is a relation serialized in an unsupported way')
+
+        # Same moves as FlattenedModelSerializer.to_representation(), done once here
+        for name, keys in getattr(serializer, 'flatten', {}).items():
+            if name not in nested_pairs:
+                raise NotCompilable(f'{name} is not a nested object and cannot be flattened')
+
+            child = nested_pairs[name]
+            del pairs[name]
+
+            for key in (child if keys is None else keys):
+                pairs[key] = child[key]
+
+        return pairs
+
+    def value(self, field, path: str) -> str:
+        cell = f'row[{self.column(path)}]'
+
+        if type(field) in PASSTHROUGH_FIELDS:
+            return cell
+
+        converter = f'convert_{len(self._namespace)}'
+        self._namespace[converter] = field.to_representation
+        # Serializer.to_representation() does not run fields on None
+        return f'(None if {cell} is None else {converter}({cell}))'
+
+    def batches(self, queryset: QuerySet, chunk_size: int):
+        """ (rows, nested lists of their owners) per chunk of rows """
+        rows = queryset.values_list(*self.columns).iterator(chunk_size=chunk_size)
+
+        while batch := list(islice(rows, chunk_size)):
+            yield batch, self.lists(batch)
+
+    def lists(self, batch: list) -> tuple:
+        """ Owner primary key -> representations, per nested list """
+        return tuple(
+            plan.grouped({row[owner] for row in batch if row[owner] is not None})
+            for owner, plan in self.nested
+        )
+
+    def grouped(self, owner_ids: set) -> dict:
+        groups = {}
+
+        if not owner_ids:
+            return groups
+
+        # Ordered the same way as the related manager the serializer would read
+        batch = list(self.model._default_manager.filter(
+            **{f'{self.group_by}__in': owner_ids}).values_list(*self.columns))
+        lists = self.lists(batch)
+
+        for row in batch:
+            groups.setdefault(row[self.key_index], []).append(self.build(row, lists))
+
+        return groups
+
+
+class CompiledSerializer:
+    """
+    Read-only listing serializer compiled from the model serializer returned by factory,
+    which is called once, on first use:
+
+        TEAM_MEMBERS = CompiledSerializer(lambda: UserSerializer())
+        TEAM_MEMBERS(queryset).data
+    """
+
+    chunk_size = 2000
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._serializer = None
+        self._plan = None
+        self._lock = Lock()
+
+    def __call__(self, queryset: QuerySet) -> 'CompiledListing':
+        return CompiledListing(self, queryset)
+
+    @property
+    def serializer(self) -> ModelSerializer:
+        self.compile()
+        return self._serializer
+
+    @property
+    def plan(self) -> Plan:
+        self.compile()
+        return self._plan
+
+    def compile(self):
+        if self._plan is not None:
+            return
+
+        with self._lock:
+            if self._plan is None:
+                serializer = self._factory()
+                self._serializer = serializer
+                self._plan = Plan(serializer, serializer.Meta.model)
+
+    def rows(self, queryset: QuerySet, chunk_size: int = None):
+        chunk_size = chunk_size or self.chunk_size
+
+        if not settings.COMPILED_SERIALIZERS:
+            serializer = self.serializer
+            instances = planned(serializer, queryset).iterator(chunk_size=chunk_size)
+            yield from (serializer.to_representation(instance) for instance in instances)
+            return
+
+        build = self.plan.build
+
+        for batch, lists in self.plan.batches(queryset, chunk_size):
+            for row in batch:
+                yield build(row, lists)
+
+
+class CompiledListing:
+    """ What the serializer would be given with many=True: .data, or rows() for streaming """
+
+    def __init__(self, compiled: CompiledSerializer, queryset: QuerySet):
+        self.compiled = compiled
+        self.instance = queryset
+
+    def rows(self, chunk_size: int = None):
+        return self.compiled.rows(self.instance, chunk_size)
+
+    @property
+    def data(self) -> list:
+        return list(self.rows())
+
+
+def literal(pairs: dict) -> str:
+    return '{' + ', '.join(f'{key!r}: {expr}' for key, expr in pairs.items()) + '}'
@@ -0,0 +1,107 @@
+from django.conf import settings
+from typing import Optional
+from .exceptions import PayloadTooLarge
+import brotli
+import zlib
+
+# Request header listing the encodings a client can decompress after decryption
+ACCEPT_ENCODING_HEADER = 'HTTP_X_PAYLOAD_ACCEPT_ENCODING'
+
+# Set on requests/responses whose plaintext is compressed before encryption
+ENCODING_HEADER = 'X-Payload-Encoding'
+ENCODING_META_KEY = 'HTTP_X_PAYLOAD_ENCODING'
+
+BROTLI = 'br'
+DEFLATE = 'deflate'
+
+# Preferred first
+SUPPORTED_ENCODINGS = (BROTLI, DEFLATE)
+
+# The pinned brotli cannot cap what one call inflates to, request bodies only accept what zlib can bound
+REQUEST_ENCODINGS = (DEFLATE,)
+
+
+def negotiate_encoding(request) -> Optional[str]:
+    """ Best encoding accepted by the client, None if it does not support any """
+    if request is None:
+        return None
+
+    accepted = request.META.get(ACCEPT_ENCODING_HEADER, '')
+    accepted = {encoding.strip().lower() for encoding in accepted.split(',')}
+
+    for encoding in SUPPORTED_ENCODINGS:
+        if encoding in accepted:
+            return encoding
+
+    return None
+
+
+def get_request_encoding(request) -> Optional[str]:
+    if request is None:
+        return None
+
+    encoding = request.META.get(ENCODING_META_KEY)
+
+    if encoding is None:
+        return None
+
+    encoding = encoding.strip().lower()
+
+    if encoding not in REQUEST_ENCODINGS:
+        raise ValueError("Unsupported payload encoding")
+
+    return encoding
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == BROTLI:
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=settings.PAYLOAD_BROTLI_QUALITY)
+
+    return zlib.compress(data, settings.PAYLOAD_ZLIB_LEVEL)
+
+
+class Compressor:
+    """ Incremental counterpart of compress() """
+
+    def __init__(self, encoding: str):
+        if encoding == BROTLI:
+            self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=settings.PAYLOAD_BROTLI_QUALITY)
+            self._update = self._compressor.process
+            self._finalize = self._compressor.finish
+        else:
+            self._compressor = zlib.compressobj(settings.PAYLOAD_ZLIB_LEVEL)
+            self._update = self._compressor.compress
+            self._finalize = self._compressor.flush
+
+    def update(self, data: bytes) -> bytes:
+        return self._update(data)
+
+    def finalize(self) -> bytes:
+        return self._finalize()
+
+
+class Decompressor:
+    """ Incremental deflate decompression refusing to produce more than max_size bytes """
+
+    def __init__(self, max_size: int):
+        self._remaining = max_size
+        self._decompressor = zlib.decompressobj()
+
+    def update(self, data: bytes) -> bytes:
+        # One byte more than allowed is enough to detect oversized payloads, never more is inflated
+        output = self._decompressor.decompress(data, self._remaining + 1)
+        return self._consume(output)
+
+    def finalize(self) -> bytes:
+        if not self._decompressor.eof:
+            raise ValueError("Truncated compressed payload")
+
+        return self._consume(self._decompressor.flush())
+
+    def _consume(self, output: bytes) -> bytes:
+        self._remaining -= len(output)
+
+        if self._remaining < 0:
+            raise PayloadTooLarge(message='Request body is too large.')
+
+        return output
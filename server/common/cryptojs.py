@@ -2,6 +2,7 @@ from Cryptodome import Random
 from Cryptodome.Cipher import AES
 from hashlib import md5
 import base64
+import binascii
 
 BLOCK_SIZE = 16
 
@@ -69,3 +70,183 @@ def decrypt(encrypted: str | bytes, passphrase: str | bytes) -> bytes:
     except Exception as e:
         # Decryption failed
         raise
+
+
+# Envelope used once a symmetric key has been negotiated for the session:
+# base64("Session_" + key id + iv + ciphertext). No key derivation is needed.
+SESSION_MAGIC = b"Session_"
+KEY_ID_SIZE = 8
+SESSION_HEADER_SIZE = len(SESSION_MAGIC) + KEY_ID_SIZE + BLOCK_SIZE
+
+
+def generate_session_key() -> tuple[bytes, bytes]:
+    """ Returns a fresh (key_id, key) pair """
+    rng = Random.new()
+    return rng.read(KEY_ID_SIZE), rng.read(32)
+
+
+def is_session_envelope(encrypted: bytes) -> bool:
+    return len(encrypted) >= SESSION_HEADER_SIZE and encrypted[0:8] == SESSION_MAGIC
+
+
+def get_session_key_id(encrypted: bytes) -> bytes:
+    return encrypted[8:8+KEY_ID_SIZE]
+
+
+def encrypt_with_key(message: str | bytes, key_id: bytes, key: bytes) -> bytes:
+    message = to_bytes(message)
+
+    iv = Random.new().read(BLOCK_SIZE)
+    aes = AES.new(key, AES.MODE_CBC, iv)
+    return base64.b64encode(SESSION_MAGIC + key_id + iv + aes.encrypt(pad(message)))
+
+
+def decrypt_with_key(encrypted: bytes, key: bytes) -> bytes:
+    """ Decrypts an already base64-decoded session envelope """
+    if not is_session_envelope(encrypted):
+        raise ValueError("Invalid encrypted data format")
+
+    iv = encrypted[8+KEY_ID_SIZE:SESSION_HEADER_SIZE]
+    aes = AES.new(key, AES.MODE_CBC, iv)
+    return unpad(aes.decrypt(encrypted[SESSION_HEADER_SIZE:]))
+
+
+# Streaming decryption, used by CryptoParser to avoid holding several copies of the body
+
+SALTED_MAGIC = b"Salted__"
+SALTED_HEADER_SIZE = len(SALTED_MAGIC) + 8
+
+# Base64 characters needed to decode the longest envelope header
+HEADER_B64_SIZE = 44
+
+
+def is_salted_envelope(encrypted: bytes) -> bool:
+    return len(encrypted) >= SALTED_HEADER_SIZE and encrypted[0:8] == SALTED_MAGIC
+
+
+def salted_cipher(header: bytes, passphrase: bytes):
+    key_iv = bytes_to_key(passphrase, header[8:SALTED_HEADER_SIZE], 32+16)
+    return AES.new(key_iv[:32], AES.MODE_CBC, key_iv[32:])
+
+
+def session_cipher(header: bytes, key: bytes):
+    return AES.new(key, AES.MODE_CBC, header[8+KEY_ID_SIZE:SESSION_HEADER_SIZE])
+
+
+class Base64StreamDecoder:
+    """ Strict incremental base64 decoder, only trailing whitespace is tolerated """
+
+    def __init__(self):
+        self._carry = b''
+        self._padded = False
+
+    def update(self, data: bytes) -> bytes:
+        data = self._carry + data
+        stripped = data.rstrip()
+        usable = len(stripped) - len(stripped) % 4
+        self._carry = data[usable:]
+        return self._decode(stripped[:usable])
+
+    def finalize(self) -> bytes:
+        carry = self._carry.rstrip()
+        self._carry = b''
+
+        if len(carry) % 4:
+            raise ValueError("Invalid base64 length")
+
+        return self._decode(carry)
+
+    def _decode(self, data: bytes) -> bytes:
+        if not data:
+            return b''
+
+        # Padding is only valid in the very last quantum
+        if self._padded:
+            raise ValueError("Data after base64 padding")
+
+        self._padded = data.endswith(b'=')
+
+        try:
+            return binascii.a2b_base64(data, strict_mode=True)
+        except binascii.Error as e:
+            raise ValueError(str(e))
+
+
+class StreamDecryptor:
+    """ Incremental AES-CBC decryption, holds back the last block to check padding """
+
+    def __init__(self, aes):
+        self._aes = aes
+        self._carry = b''
+
+    def update(self, data: bytes) -> bytes:
+        data = self._carry + data
+        usable = len(data) - len(data) % BLOCK_SIZE - BLOCK_SIZE
+
+        if usable <= 0:
+            self._carry = data
+            return b''
+
+        self._carry = data[usable:]
+        return self._aes.decrypt(data[:usable])
+
+    def finalize(self) -> bytes:
+        if not self._carry or len(self._carry) % BLOCK_SIZE:
+            raise ValueError("Ciphertext is not a multiple of the block size")
+
+        decrypted = self._aes.decrypt(self._carry)
+        length = decrypted[-1]
+
+        if not 0 < length <= BLOCK_SIZE or decrypted[-length:] != bytes([length]) * length:
+            raise ValueError("Invalid padding")
+
+        return decrypted[:-length]
+
+
+class StreamEncryptor:
+    """ Incremental AES-CBC encryption producing the same envelopes as encrypt/encrypt_with_key """
+
+    def __init__(self, aes, header: bytes):
+        self._aes = aes
+        self._header = header
+        self._carry = b''
+
+    @classmethod
+    def with_passphrase(cls, passphrase: str | bytes):
+        header = SALTED_MAGIC + Random.new().read(8)
+        return cls(salted_cipher(header, to_bytes(passphrase)), header)
+
+    @classmethod
+    def with_session_key(cls, key_id: bytes, key: bytes):
+        header = SESSION_MAGIC + key_id + Random.new().read(BLOCK_SIZE)
+        return cls(session_cipher(header, key), header)
+
+    def update(self, data: bytes) -> bytes:
+        data = self._carry + data
+        usable = len(data) - len(data) % BLOCK_SIZE
+        self._carry = data[usable:]
+        return self._take_header() + self._aes.encrypt(data[:usable])
+
+    def finalize(self) -> bytes:
+        data, self._carry = self._carry, b''
+        return self._take_header() + self._aes.encrypt(pad(data))
+
+    def _take_header(self) -> bytes:
+        # The header is emitted in front of the first ciphertext block
+        header, self._header = self._header, b''
+        return header
+
+
+class Base64StreamEncoder:
+    def __init__(self):
+        self._carry = b''
+
+    def update(self, data: bytes) -> bytes:
+        data = self._carry + data
+        usable = len(data) - len(data) % 3
+        self._carry = data[usable:]
+        return binascii.b2a_base64(data[:usable], newline=False)
+
+    def finalize(self) -> bytes:
+        carry, self._carry = self._carry, b''
+        return binascii.b2a_base64(carry, newline=False)
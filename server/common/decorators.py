@@ -1,17 +1,39 @@
 from django.http import HttpResponseForbidden
 from common.exceptions import BadRequest
+from users_auth.authentication import get_token_user
 from functools import wraps
 
 
+def authenticate_token(request):
+    """ Use the user of a valid access token, the session is not looked up then """
+    token_user = get_token_user(request)
+
+    if token_user is not None:
+        request.user = token_user
+
+
 def login_required(view_func):
     @wraps(view_func)
     def _wrapped_view(request, *args, **kwargs):
+        authenticate_token(request)
+
         if not request.user.is_authenticated:
             return HttpResponseForbidden("Unauthorized")
         return view_func(request, *args, **kwargs)
     return _wrapped_view
 
 
+def admin_required(view_func):
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        authenticate_token(request)
+
+        if not request.user.is_authenticated or request.user.profile.role != 'admin':
+            return HttpResponseForbidden("Forbidden")
+        return view_func(request, *args, **kwargs)
+    return _wrapped_view
+
+
 def body(fields: set[str]):
     """ Enforce what fields must be present in the request body """
 
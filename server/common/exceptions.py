@@ -50,6 +50,16 @@ class Unauthorized(CustomAPIException):
     }
 
 
+class PayloadTooLarge(CustomAPIException):
+    status_code = 413
+    default_code = 'payload_too_large'
+    default_detail = {
+        'status': 413,
+        'error': 'Payload too large',
+        'message': '',
+    }
+
+
 class InvalidOrExpired(CustomAPIException):
     status_code = 498
     default_code = 'invalid'
@@ -60,6 +70,16 @@ class InvalidOrExpired(CustomAPIException):
     }
 
 
+class ServiceUnavailable(CustomAPIException):
+    status_code = 503
+    default_code = 'service_unavailable'
+    default_detail = {
+        'status': 503,
+        'error': 'Service unavailable',
+        'message': '',
+    }
+
+
 class InternalServerError(CustomAPIException):
     status_code = 500
     default_code = 'internal_server_error'
@@ -0,0 +1,119 @@
+"""
+Unique public identifiers without existence checks.
+Every allocator hands out numbers from a database sequence (IdSequence), reserved by
+blocks of ID_BLOCK_SIZE per process, and maps them through a keyed Feistel
+permutation of a fixed bit width. Distinct numbers always give distinct identifiers,
+and without ID_ALLOCATOR_SECRET consecutive ones look random. They are not secrets:
+anything granting access (verification and reset password links) uses random tokens.
+
+ID_ALLOCATOR_SECRET must never change once identifiers have been issued,
+a different key gives a different permutation which can collide with earlier identifiers.
+"""
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from threading import Lock
+from common import metrics
+from .models import IdSequence
+import hashlib
+import hmac
+import string
+
+BASE36 = string.ascii_lowercase + string.digits
+
+FEISTEL_ROUNDS = 8
+
+
+class IdAllocator:
+    def __init__(self, name: str, bits: int, alphabet: str, length: int, prefix: str = ''):
+        assert bits % 2 == 0, 'Feistel halves must be balanced'
+        assert len(alphabet) ** length >= 2 ** bits, 'Identifier too short for the permutation domain'
+
+        self.name = name
+        self.bits = bits
+        self.alphabet = alphabet
+        self.length = length
+        self.prefix = prefix
+
+        self._next = 0
+        self._end = 0
+        self._lock = Lock()
+        self._key = None
+
+    def allocate(self) -> str:
+        return self.format(self.permute(self.next_number()))
+
+    def next_number(self) -> int:
+        with self._lock:
+            if self._next < self._end:
+                self._next += 1
+                return self._next - 1
+
+            if connection.in_atomic_block:
+                # A block reserved here would be rolled back with the caller's transaction while
+                # its numbers stay cached, so only reserve what is used right away
+                start, _ = self.reserve(1)
+                return start
+
+            self._next, self._end = self.reserve(settings.ID_BLOCK_SIZE)
+            self._next += 1
+            return self._next - 1
+
+    def reserve(self, size: int) -> tuple[int, int]:
+        """ Returns the reserved [start, end) range """
+        metrics.increment('ids.reserved_blocks')
+
+        while True:
+            with transaction.atomic():
+                # Updating first takes the row lock, on every database
+                updated = IdSequence.objects.filter(name=self.name).update(next_value=F('next_value') + size)
+
+                if updated:
+                    end = IdSequence.objects.values_list('next_value', flat=True).get(name=self.name)
+                    return end - size, end
+
+                try:
+                    with transaction.atomic():
+                        IdSequence.objects.create(name=self.name, next_value=size)
+                    return 0, size
+                except IntegrityError:
+                    # Created concurrently, reserve from it instead
+                    continue
+
+    def permute(self, value: int) -> int:
+        half = self.bits // 2
+        mask = (1 << half) - 1
+        left, right = value >> half, value & mask
+
+        for round_idx in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ self.round_function(round_idx, right, mask)
+
+        return (left << half) | right
+
+    def round_function(self, round_idx: int, value: int, mask: int) -> int:
+        digest = hmac.new(self.key, f'{round_idx}:{value}'.encode(), hashlib.sha256).digest()
+        return int.from_bytes(digest[:16], 'big') & mask
+
+    @property
+    def key(self) -> bytes:
+        if self._key is None:
+            self._key = hmac.new(
+                settings.ID_ALLOCATOR_SECRET.encode(), f'common.ids.{self.name}'.encode(), hashlib.sha256
+            ).digest()
+
+        return self._key
+
+    def format(self, value: int) -> str:
+        base = len(self.alphabet)
+        chars = []
+
+        for _ in range(self.length):
+            value, digit = divmod(value, base)
+            chars.append(self.alphabet[digit])
+
+        return self.prefix + ''.join(reversed(chars))
+
+
+# MOK-xxxxxxxx and T-xxxxxxxx, 36^8 > 2^40
+PROFILE_TAGS = IdAllocator('profile_tag', bits=40, alphabet=BASE36, length=8, prefix='MOK-')
+TEAM_IDS = IdAllocator('team_id', bits=40, alphabet=BASE36, length=8, prefix='T-')
@@ -0,0 +1,194 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+from common.cryptojs import bytes_to_key, decrypt, encrypt
+from common.parsers import CryptoParser
+from common.renderers import CryptoRenderer
+from io import BytesIO
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+DEFAULT_SIZES = [100, 1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024]
+
+
+def make_payload(size: int) -> dict:
+    """ JSON document shaped like a registration listing, about `size` bytes once rendered """
+    row = {
+        'id': 1, 'email': 'participant@example.com', 'username': 'participant',
+        'first_name': 'First', 'last_name': 'Last', 'tag': 'MOK-a1b2c3d4',
+        'phone_no': '9876543210', 'institution': 'NIT Agartala', 'avatar_idx': 3,
+    }
+    row_size = len(json.dumps(row, separators=(',', ':'))) + 1
+    rows = [dict(row, id=idx) for idx in range(max(1, size // row_size))]
+    return {'data': rows}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the payload encryption layer (cryptojs, CryptoParser, CryptoRenderer)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+            help='Payload sizes in bytes')
+        parser.add_argument(
+            '--min-time', type=float, default=1.0,
+            help='Minimum seconds spent on each case')
+        parser.add_argument(
+            '--max-iterations', type=int, default=10000,
+            help='Upper bound of iterations per case')
+        parser.add_argument(
+            '--output', default=None,
+            help='Write the JSON results to this file instead of stdout')
+        parser.add_argument(
+            '--baseline', default=None,
+            help='Previous results file, exit with an error if any case got slower')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='Allowed p50 slowdown relative to the baseline (0.25 = 25%%)')
+
+    def handle(self, *args, **options):
+        self.min_time = options['min_time']
+        self.max_iterations = options['max_iterations']
+        self.factory = RequestFactory()
+        self.secret = 'benchmark-passphrase'
+
+        results = []
+
+        with override_settings(PAYLOAD_SECRET=self.secret, PAYLOAD_LENIENT_PARSING=True):
+            for size in options['sizes']:
+                # Oversized bodies are only rejected when they go over the limit
+                with override_settings(PAYLOAD_MAX_BODY_BYTES=max(size * 4, 1024 * 1024)):
+                    results.extend(self.bench_size(size))
+
+                self.stderr.write(f'{size} bytes done')
+
+            results.extend(self.bench_fallbacks())
+            results.extend(self.bench_oversized())
+
+        report = {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def bench_size(self, size):
+        payload = make_payload(size)
+        plaintext = json.dumps(payload, separators=(',', ':')).encode()
+        ciphertext = encrypt(plaintext, self.secret)
+        renderer = CryptoRenderer()
+
+        return [
+            self.run('bytes_to_key', size, lambda: bytes_to_key(self.secret.encode(), b'saltsalt')),
+            self.run('encrypt', size, lambda: encrypt(plaintext, self.secret)),
+            self.run('decrypt', size, lambda: decrypt(ciphertext, self.secret)),
+            self.run('parser.encrypted', size, self.parse(ciphertext)),
+            self.run('parser.plain_json', size, self.parse(plaintext)),
+            self.run('parser.malformed', size, self.parse(b'#' * len(ciphertext))),
+            self.run('renderer', size, lambda: renderer.render(
+                payload, renderer_context={'request': None, 'response': Response()})),
+        ]
+
+    def bench_fallbacks(self):
+        """ Lenient branches, each one measured on its own """
+        size = 10 * 1024
+        plaintext = json.dumps(make_payload(size)).encode()
+        ciphertext = encrypt(plaintext, self.secret)
+
+        cases = {
+            'parser.fallback.json_pattern': b'garbage {"username": "participant"} garbage',
+            'parser.fallback.padding': ciphertext.rstrip(b'='),
+            'parser.fallback.form': b'username=participant&password=secret',
+            'parser.fallback.raw': b'%' * size,
+            'parser.fallback.wrong_key': encrypt(plaintext, 'some other passphrase'),
+        }
+
+        return [self.run(name, len(body), self.parse(body)) for name, body in cases.items()]
+
+    def bench_oversized(self):
+        size = 1024 * 1024
+        body = b'A' * (size + 4)
+
+        with override_settings(PAYLOAD_MAX_BODY_BYTES=size):
+            return [
+                self.run('parser.oversized.content_length', len(body), self.parse(body)),
+                self.run('parser.oversized.streamed', len(body), self.parse(body, content_length=False)),
+            ]
+
+    def parse(self, body: bytes, content_length=True):
+        """ Returns a callable parsing `body`, the request is built outside of the timed part """
+        request = self.factory.post('/', data=body, content_type='text/plain')
+        parser = CryptoParser()
+
+        if not content_length:
+            del request.META['CONTENT_LENGTH']
+
+        def _parse():
+            try:
+                return parser.parse(BytesIO(body), parser_context={'request': request})
+            except APIException:
+                return None
+
+        return _parse
+
+    def run(self, name, size, func):
+        timings = []
+        started = time.perf_counter()
+
+        while len(timings) < 3 or (
+            time.perf_counter() - started < self.min_time and len(timings) < self.max_iterations
+        ):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+
+        timings.sort()
+        total = sum(timings)
+
+        return {
+            'name': name,
+            'size': size,
+            'iterations': len(timings),
+            'ops_per_sec': len(timings) / total if total else None,
+            'mb_per_sec': size * len(timings) / total / 1e6 if total else None,
+            'mean_ms': statistics.fmean(timings) * 1e3,
+            'p50_ms': self.percentile(timings, 50) * 1e3,
+            'p90_ms': self.percentile(timings, 90) * 1e3,
+            'p99_ms': self.percentile(timings, 99) * 1e3,
+            'max_ms': timings[-1] * 1e3,
+        }
+
+    def compare(self, results, baseline_path, tolerance):
+        with open(baseline_path) as file:
+            baseline = {(case['name'], case['size']): case for case in json.load(file)['results']}
+
+        regressions = []
+
+        for case in results:
+            previous = baseline.get((case['name'], case['size']))
+
+            if previous and case['p50_ms'] > previous['p50_ms'] * (1 + tolerance):
+                regressions.append(
+                    f"{case['name']} ({case['size']} bytes): "
+                    f"{previous['p50_ms']:.3f}ms -> {case['p50_ms']:.3f}ms")
+
+        if regressions:
+            raise CommandError('Slower than baseline:\n' + '\n'.join(regressions))
+
+    def percentile(self, timings, percent):
+        return timings[min(len(timings) - 1, int(len(timings) * percent / 100))]
@@ -0,0 +1,54 @@
+"""
+Minimal in-process metrics. Values are per worker process and reset on restart.
+"""
+from threading import Lock
+import time
+
+_lock = Lock()
+_counters: dict[str, int] = {}
+_gauges: dict[str, float] = {}
+_timings: dict[str, list[float]] = {}  # name -> [count, total, max]
+
+
+def increment(name: str, value: int = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float):
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, seconds: float):
+    with _lock:
+        timing = _timings.setdefault(name, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+
+
+class timer:
+    """ Context manager recording the elapsed time of a block """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.start)
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'timings': {
+                name: {'count': count, 'total': total, 'max': maximum}
+                for name, (count, total, maximum) in _timings.items()
+            },
+        }
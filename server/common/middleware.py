@@ -1,3 +1,12 @@
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.functional import SimpleLazyObject
+from rest_framework.response import Response
+from .offload import estimate_size, run_async
+from .payload_keys import get_response_key
+from users import snapshot
+
+
 class AllowAnyHostMiddleware:
     """
     Middleware that allows any host header.
@@ -35,3 +44,51 @@ class AllowAnyHostMiddleware:
         request.get_host = original_get_host
         
         return response
+
+
+class OffloadRenderMiddleware:
+    """
+    Under ASGI, render large DRF responses (JSON, compression and encryption)
+    on the bounded offload pool instead of the request thread.
+    Does nothing for WSGI requests.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_template_response(self, request, response):
+        if not isinstance(request, ASGIRequest) or not isinstance(response, Response):
+            return response
+
+        if estimate_size(response.data) < settings.PAYLOAD_OFFLOAD_THRESHOLD:
+            return response
+
+        # Resolve session backed state here, the pool threads should not touch the database
+        get_response_key(request)
+
+        sync_render = response.render
+
+        async def render():
+            del response.render
+            await run_async(sync_render)
+            return response
+
+        # The ASGI handler awaits render() when it is a coroutine function
+        response.render = render
+        return response
+
+
+class AuthSnapshotMiddleware:
+    """ Replaces request.user with one built from the cached auth snapshot (users.snapshot) """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.AUTH_SNAPSHOT:
+            request.user = SimpleLazyObject(lambda: snapshot.get_user(request))
+
+        return self.get_response(request)
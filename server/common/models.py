@@ -0,0 +1,10 @@
+from django.db.models import Model, CharField, BigIntegerField
+
+
+class IdSequence(Model):
+    """ Next unreserved value of each common.ids allocator """
+    name = CharField(primary_key=True, max_length=50, null=False)
+    next_value = BigIntegerField(null=False)
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,101 @@
+"""
+Bounded thread pool for CPU heavy payload work (JSON rendering, compression, AES).
+pycryptodome and zlib/brotli release the GIL, so threads are enough to keep the
+event loop and the other requests responsive.
+"""
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from threading import Lock
+from . import metrics
+import asyncio
+import time
+
+_lock = Lock()
+_executor = None
+_pending = 0
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PAYLOAD_OFFLOAD_WORKERS,
+                thread_name_prefix='payload-offload'
+            )
+
+    return _executor
+
+
+def _track(delta: int) -> bool:
+    """ Update the queue depth, refusing to go over PAYLOAD_OFFLOAD_MAX_QUEUE """
+    global _pending
+
+    with _lock:
+        if delta > 0 and _pending >= settings.PAYLOAD_OFFLOAD_MAX_QUEUE:
+            return False
+
+        _pending += delta
+        metrics.set_gauge('offload.queue_depth', _pending)
+        return True
+
+
+def submit(fn, *args):
+    """ Returns a future, or None when the pool is saturated and the caller should run fn itself """
+    if not _track(1):
+        metrics.increment('offload.saturated')
+        return None
+
+    submitted_at = time.perf_counter()
+
+    def _run():
+        started_at = time.perf_counter()
+        metrics.observe('offload.wait_seconds', started_at - submitted_at)
+
+        try:
+            return fn(*args)
+        finally:
+            metrics.observe('offload.run_seconds', time.perf_counter() - started_at)
+            _track(-1)
+
+    try:
+        return get_executor().submit(_run)
+    except RuntimeError:
+        # Interpreter shutting down
+        _track(-1)
+        return None
+
+
+async def run_async(fn, *args):
+    future = submit(fn, *args)
+
+    if future is None:
+        # Same as what the ASGI handler does without offloading
+        metrics.increment('offload.inline')
+        return await sync_to_async(fn, thread_sensitive=True)(*args)
+
+    return await asyncio.wrap_future(future)
+
+
+def estimate_size(data, depth=0) -> int:
+    """
+    Cheap estimate of the rendered JSON size, lists are extrapolated from their first item.
+    Querysets and unknown objects count as small so they are never rendered off-thread.
+    """
+    if depth > 8:
+        return 0
+
+    if isinstance(data, dict):
+        return sum(len(str(key)) + estimate_size(value, depth + 1) for key, value in data.items())
+
+    if isinstance(data, (list, tuple)):
+        if not data:
+            return 2
+        return len(data) * (estimate_size(data[0], depth + 1) + 1)
+
+    if isinstance(data, str):
+        return len(data) + 2
+
+    return 8
@@ -1,14 +1,21 @@
 from rest_framework.parsers import BaseParser, JSONParser
 from rest_framework.exceptions import ParseError
-from .cryptojs import decrypt
+from django.conf import settings
+from .cryptojs import (
+    HEADER_B64_SIZE, SALTED_HEADER_SIZE, SESSION_HEADER_SIZE, Base64StreamDecoder, StreamDecryptor, decrypt, get_session_key_id,
+    is_salted_envelope, is_session_envelope, salted_cipher, session_cipher
+)
+from .compression import Decompressor, get_request_encoding
+from .exceptions import PayloadTooLarge
+from .payload_keys import get_session_key
+from . import metrics
 import json
-import environ
 import base64
-import traceback
 import re
+import zlib
 
-env = environ.Env()
-environ.Env.read_env()
+# Multiple of 4 so that every chunk is made of whole base64 quanta
+READ_CHUNK_SIZE = 64 * 1024
 
 
 class CryptoParser(BaseParser):
@@ -16,168 +23,260 @@ class CryptoParser(BaseParser):
     json_parser = JSONParser()
 
     def parse(self, stream, media_type=None, parser_context=None):
-        try:
-            # Read the request body
-            ciphertext_b64 = stream.read()
+        request = (parser_context or {}).get('request')
+        max_size = settings.PAYLOAD_MAX_BODY_BYTES
 
-            # Data received
+        content_length = self.get_content_length(request)
 
-            # Handle empty data
-            if not ciphertext_b64:
-                return {}
+        if content_length is not None and content_length > max_size:
+            raise self.too_large()
 
-            # Try to handle as plain JSON first (not encrypted)
-            try:
-                if isinstance(ciphertext_b64, bytes):
-                    text_data = ciphertext_b64.decode('utf-8', errors='replace')
-                else:
-                    text_data = ciphertext_b64
+        try:
+            encoding = get_request_encoding(request)
+        except ValueError:
+            raise ParseError('Unsupported payload encoding')
 
-                # Check if it looks like JSON
-                if text_data.strip().startswith('{'):
+        # Raw body is only kept around if it may be needed by the lenient fallbacks,
+        # compressed payloads come from up to date clients so they never need them
+        body = [] if settings.PAYLOAD_LENIENT_PARSING and encoding is None else None
 
-                    return json.loads(text_data)
-            except Exception as e:
+        try:
+            data = self.parse_strict(stream, request, max_size, body, encoding)
+            metrics.increment('parser.strict')
+            return data
+        except ParseError:
+            if body is None:
+                metrics.increment('parser.rejected')
+                raise
 
-                pass
+            # Read whatever is left so the fallbacks see the whole payload
+            body.append(self.read(stream, max_size - sum(len(chunk) for chunk in body)))
+            return lenient_parse(b''.join(body))
 
-            # Try to decrypt the data
-            try:
-                # Ensure we're working with bytes
-                if not isinstance(ciphertext_b64, bytes):
+    def parse_strict(self, stream, request, max_size, body, encoding=None):
+        head = self.read(stream, HEADER_B64_SIZE)
+        total = len(head)
+
+        if body is not None:
+            body.append(head)
 
-                    ciphertext_b64 = ciphertext_b64.encode('utf-8', errors='replace')
+        # Handle empty data
+        if not head.strip():
+            return {}
 
-                # Check if it's valid base64
-                try:
-                    # Try to decode base64 to validate format
-                    decoded = base64.b64decode(ciphertext_b64)
-                    # Check if it has the 'Salted__' prefix
-                    if len(decoded) >= 8 and decoded[:8] == b'Salted__':
-                        pass
+        # Plain JSON (not encrypted)
+        if head.lstrip()[:1] in (b'{', b'['):
+            rest = self.read(stream, max_size - total + 1)
 
-                except Exception as e:
+            if body is not None:
+                body.append(rest)
 
-                    # If not valid base64, try to parse as JSON directly again
-                    try:
-                        if isinstance(ciphertext_b64, bytes):
-                            text_data = ciphertext_b64.decode('utf-8', errors='replace')
-                        else:
-                            text_data = ciphertext_b64
+            if total + len(rest) > max_size:
+                raise self.too_large()
+
+            try:
+                return json.loads(head + rest)
+            except ValueError:
+                raise ParseError('Invalid JSON')
 
-                        return json.loads(text_data)
-                    except json.JSONDecodeError as e:
+        # Check the envelope header before reading the rest of the body
+        decoder = Base64StreamDecoder()
 
-                        # Try to extract JSON from the data if it contains JSON-like patterns
-                        json_pattern = r'\{[^\{\}]*\}'  # Simple pattern to find JSON objects
-                        matches = re.findall(json_pattern, text_data)
-                        if matches:
+        try:
+            header = decoder.update(head)
+        except ValueError:
+            raise ParseError('Invalid data format')
+
+        if is_salted_envelope(header):
+            aes = salted_cipher(header, settings.PAYLOAD_SECRET.encode())
+            header_size = SALTED_HEADER_SIZE
+        elif is_session_envelope(header):
+            session_key = get_session_key(request) if settings.PAYLOAD_SESSION_KEYS and request is not None else None
+
+            if session_key is None or session_key.key_id != get_session_key_id(header):
+                raise ParseError('Unknown payload key')
+
+            aes = session_cipher(header, session_key.key)
+            header_size = SESSION_HEADER_SIZE
+        else:
+            raise ParseError('Invalid data format')
+
+        decryptor = StreamDecryptor(aes)
+
+        # Compressed plaintext is inflated as it is decrypted
+        if encoding is not None:
+            decompressor = Decompressor(max_size)
+            decrypt_update = lambda data: decompressor.update(decryptor.update(data))
+        else:
+            decompressor = None
+            decrypt_update = decryptor.update
 
-                            try:
-                                return json.loads(matches[0])
-                            except json.JSONDecodeError:
-                                pass
+        try:
+            plaintext = [decrypt_update(header[header_size:])]
 
-                        # Not JSON either, raise the original error
-                        raise ParseError(f"Invalid data format: not valid base64 or JSON")
+            while True:
+                chunk = self.read(stream, READ_CHUNK_SIZE)
 
-                # Decrypt the data
-                payload_secret = env('PAYLOAD_SECRET')
+                if not chunk:
+                    break
 
+                total += len(chunk)
 
-                try:
-                    decrypted_bytes = decrypt(ciphertext_b64, payload_secret)
-                except Exception as e:
+                if body is not None:
+                    body.append(chunk)
 
-                    # If standard decryption fails, try alternative approaches
+                if total > max_size:
+                    raise self.too_large()
 
-                    # Try with different padding or format
-                    try:
-                        # Try to fix padding if needed
-                        padding_needed = len(ciphertext_b64) % 4
-                        if padding_needed:
-                            padded = ciphertext_b64 + b'=' * (4 - padding_needed) if isinstance(ciphertext_b64, bytes) else ciphertext_b64 + '=' * (4 - padding_needed)
+                plaintext.append(decrypt_update(decoder.update(chunk)))
 
-                            decrypted_bytes = decrypt(padded, payload_secret)
+            plaintext.append(decrypt_update(decoder.finalize()))
 
-                        else:
-                            raise Exception("Padding is correct, issue is elsewhere")
-                    except Exception as pad_error:
+            if decompressor is not None:
+                plaintext.append(decompressor.update(decryptor.finalize()))
+                plaintext.append(decompressor.finalize())
+            else:
+                plaintext.append(decryptor.finalize())
+        except (ValueError, zlib.error):
+            raise ParseError('Invalid payload')
 
+        try:
+            return json.loads(b''.join(plaintext))
+        except ValueError:
+            raise ParseError('Invalid JSON')
 
-                        # As a fallback, try to parse as JSON directly one more time
-                        try:
-                            if isinstance(ciphertext_b64, bytes):
-                                text_data = ciphertext_b64.decode('utf-8', errors='replace')
-                            else:
-                                text_data = ciphertext_b64
+    def read(self, stream, size):
+        chunks = []
 
+        while stream is not None and size > 0:
+            data = stream.read(size)
 
-                            # Try to find JSON-like patterns in the data
-                            json_pattern = r'\{[^\{\}]*\}'  # Simple pattern to find JSON objects
-                            matches = re.findall(json_pattern, text_data)
-                            if matches:
+            if not data:
+                break
 
-                                try:
-                                    return json.loads(matches[0])
-                                except json.JSONDecodeError:
-                                    pass
+            chunks.append(data.encode() if isinstance(data, str) else data)
+            size -= len(data)
 
-                            # Try direct JSON parsing
-                            return json.loads(text_data)
-                        except json.JSONDecodeError as json_error:
+        return b''.join(chunks)
 
+    def get_content_length(self, request):
+        if request is None:
+            return None
 
-                            # If we have form data, try to parse it
-                            if '=' in text_data and '&' in text_data:
+        try:
+            return int(request.META.get('CONTENT_LENGTH'))
+        except (TypeError, ValueError):
+            return None
 
-                                form_data = {}
-                                pairs = text_data.split('&')
-                                for pair in pairs:
-                                    if '=' in pair:
-                                        key, value = pair.split('=', 1)
-                                        form_data[key] = value
-                                return form_data
+    def too_large(self):
+        metrics.increment('parser.rejected.too_large')
+        return PayloadTooLarge(message='Request body is too large.')
 
-                            # If all else fails, create a minimal valid response
 
-                            return {"_raw_data": text_data[:100] + "..."}  # Include raw data for debugging
+# Simple pattern to find JSON objects
+JSON_PATTERN = re.compile(r'\{[^\{\}]*\}')
 
-                # Try to decode as UTF-8
-                try:
-                    stringified_json = decrypted_bytes.decode('utf-8')
-                except UnicodeDecodeError:
-                    # If UTF-8 decoding fails, try with latin-1 which never fails
-                    stringified_json = decrypted_bytes.decode('latin-1')
 
-                # Parse the JSON
-                try:
-                    return json.loads(stringified_json)
-                except json.JSONDecodeError as e:
+def find_json(text_data: str):
+    match = JSON_PATTERN.search(text_data)
 
+    if match is not None:
+        try:
+            return json.loads(match.group(0))
+        except json.JSONDecodeError:
+            pass
 
-                    # Try to find JSON-like patterns in the data
-                    json_pattern = r'\{[^\{\}]*\}'  # Simple pattern to find JSON objects
-                    matches = re.findall(json_pattern, stringified_json)
-                    if matches:
+    return None
 
-                        try:
-                            return json.loads(matches[0])
-                        except json.JSONDecodeError:
-                            pass
 
-                    # If we can't parse as JSON, return the raw string as data
+def lenient_parse(ciphertext_b64: bytes):
+    """
+    Best effort parsing for payloads rejected by the strict path.
+    Enabled by PAYLOAD_LENIENT_PARSING, every branch taken is counted in metrics.
+    """
+    text_data = ciphertext_b64.decode('utf-8', errors='replace')
 
-                    return {"message": stringified_json[:100] + "..."}
+    # Check if it's valid base64
+    try:
+        base64.b64decode(ciphertext_b64)
+    except Exception:
+        # If not valid base64, try to parse as JSON directly
+        try:
+            data = json.loads(text_data)
+            metrics.increment('parser.fallback.json')
+            return data
+        except json.JSONDecodeError:
+            # Try to extract JSON from the data if it contains JSON-like patterns
+            data = find_json(text_data)
+
+            if data is not None:
+                metrics.increment('parser.fallback.json_pattern')
+                return data
+
+            metrics.increment('parser.fallback.error')
+            return {"_error": "Invalid data format: not valid base64 or JSON"}
+
+    payload_secret = settings.PAYLOAD_SECRET
+
+    try:
+        decrypted_bytes = decrypt(ciphertext_b64, payload_secret)
+        metrics.increment('parser.fallback.decrypt')
+    except Exception:
+        # Try to fix padding if needed
+        try:
+            padding_needed = len(ciphertext_b64) % 4
 
-            except Exception as e:
+            if not padding_needed:
+                raise ValueError("Padding is correct, issue is elsewhere")
 
+            decrypted_bytes = decrypt(ciphertext_b64 + b'=' * (4 - padding_needed), payload_secret)
+            metrics.increment('parser.fallback.padding')
+        except Exception:
+            data = find_json(text_data)
 
-                # Instead of failing, return a minimal valid response
-                return {"_error": str(e)}
+            if data is not None:
+                metrics.increment('parser.fallback.json_pattern')
+                return data
 
-        except Exception as exc:
-            # Error occurred during parsing
+            try:
+                data = json.loads(text_data)
+                metrics.increment('parser.fallback.json')
+                return data
+            except json.JSONDecodeError:
+                pass
 
-            # Instead of failing, return a minimal valid response
-            return {"_parse_error": str(exc)}
+            # If we have form data, try to parse it
+            if '=' in text_data and '&' in text_data:
+                metrics.increment('parser.fallback.form')
+                form_data = {}
+
+                for pair in text_data.split('&'):
+                    if '=' in pair:
+                        key, value = pair.split('=', 1)
+                        form_data[key] = value
+
+                return form_data
+
+            # Include raw data for debugging
+            metrics.increment('parser.fallback.raw')
+            return {"_raw_data": text_data[:100] + "..."}
+
+    try:
+        stringified_json = decrypted_bytes.decode('utf-8')
+    except UnicodeDecodeError:
+        # If UTF-8 decoding fails, try with latin-1 which never fails
+        metrics.increment('parser.fallback.latin1')
+        stringified_json = decrypted_bytes.decode('latin-1')
+
+    try:
+        return json.loads(stringified_json)
+    except json.JSONDecodeError:
+        data = find_json(stringified_json)
+
+        if data is not None:
+            metrics.increment('parser.fallback.json_pattern')
+            return data
+
+        # If we can't parse as JSON, return the raw string as data
+        metrics.increment('parser.fallback.message')
+        return {"message": stringified_json[:100] + "..."}
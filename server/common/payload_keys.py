@@ -0,0 +1,69 @@
+from django.conf import settings
+from typing import NamedTuple, Optional
+from .cryptojs import generate_session_key
+import base64
+
+SESSION_KEY_FIELD = '_payload_key'
+SESSION_KEY_ID_FIELD = '_payload_key_id'
+
+# Clients opt into the session envelope for responses by echoing the key id
+KEY_ID_HEADER = 'HTTP_X_PAYLOAD_KEY_ID'
+
+
+class SessionKey(NamedTuple):
+    key_id: bytes
+    key: bytes
+
+
+def issue_session_key(request) -> dict:
+    """
+    Generate a payload key for the session of an authenticated request.
+    The returned dict is meant to be merged into the login response.
+    """
+    key_id, key = generate_session_key()
+
+    request.session[SESSION_KEY_ID_FIELD] = key_id.hex()
+    request.session[SESSION_KEY_FIELD] = base64.b64encode(key).decode()
+
+    return {
+        'payload_key_id': key_id.hex(),
+        'payload_key': base64.b64encode(key).decode(),
+    }
+
+
+def get_session_key(request) -> Optional[SessionKey]:
+    # DRF requests proxy to the Django request, cache the decoded key there
+    django_request = getattr(request, '_request', request)
+
+    if hasattr(django_request, '_payload_session_key'):
+        return django_request._payload_session_key
+
+    session_key = None
+    session = getattr(django_request, 'session', None)
+
+    if session is not None and SESSION_KEY_ID_FIELD in session:
+        session_key = SessionKey(
+            key_id=bytes.fromhex(session[SESSION_KEY_ID_FIELD]),
+            key=base64.b64decode(session[SESSION_KEY_FIELD]),
+        )
+
+    django_request._payload_session_key = session_key
+    return session_key
+
+
+def get_response_key(request) -> Optional[SessionKey]:
+    """ Session key to encrypt the response with, if the client asked for it """
+    if request is None or not settings.PAYLOAD_SESSION_KEYS:
+        return None
+
+    requested_key_id = request.META.get(KEY_ID_HEADER)
+
+    if not requested_key_id:
+        return None
+
+    session_key = get_session_key(request)
+
+    if session_key is None or session_key.key_id.hex() != requested_key_id.lower():
+        return None
+
+    return session_key
@@ -1,11 +1,11 @@
 from rest_framework.renderers import JSONRenderer
-from .cryptojs import encrypt
-import environ
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from .compression import ENCODING_HEADER, compress, negotiate_encoding
+from .cryptojs import encrypt, encrypt_with_key
+from .payload_keys import get_response_key
 import json
 
-env = environ.Env()
-environ.Env.read_env()
-
 
 class CryptoRenderer(JSONRenderer):
     charset = 'utf-8'
@@ -20,9 +20,19 @@ class CryptoRenderer(JSONRenderer):
             # Render the JSON
             json_rendered = super().render(data, accepted_media_type, renderer_context)
 
+            # Compress large payloads for clients that can inflate them after decryption
+            request = (renderer_context or {}).get('request')
+            response = (renderer_context or {}).get('response')
+            json_rendered = self.compress(json_rendered, request, response)
+
             # Encrypt the response
             try:
-                encrypted = encrypt(json_rendered, env('PAYLOAD_SECRET')).decode()
+                session_key = get_response_key(request)
+
+                if session_key is not None:
+                    return encrypt_with_key(json_rendered, session_key.key_id, session_key.key).decode()
+
+                encrypted = encrypt(json_rendered, settings.PAYLOAD_SECRET).decode()
                 return encrypted
             except Exception as e:
                 # Encryption failed
@@ -33,3 +43,18 @@ class CryptoRenderer(JSONRenderer):
             # Renderer error occurred
             # If anything fails, return a simple JSON error
             return json.dumps({"error": "Error rendering response"}).encode()
+
+    def compress(self, json_rendered, request, response):
+        if response is not None:
+            patch_vary_headers(response, ['X-Payload-Accept-Encoding'])
+
+        if len(json_rendered) < settings.PAYLOAD_COMPRESSION_THRESHOLD:
+            return json_rendered
+
+        encoding = negotiate_encoding(request)
+
+        if encoding is None or response is None:
+            return json_rendered
+
+        response[ENCODING_HEADER] = encoding
+        return compress(json_rendered, encoding)
@@ -0,0 +1,335 @@
+"""
+Serialized representations of the rows nested across many responses (team leaders,
+members, contests), reused instead of running the serializer again for every request.
+
+Entries live in a per-process LRU keyed by serializer spec, model and primary key, and
+are stamped with the versions of the rows they were built from. Versions are kept in
+CACHES and dropped when one of those rows is saved or deleted, so entries built before
+are never served again. A row extending another one through a one to one field (a
+Profile and its User) drops the version of that row as well.
+
+Versions read from CACHES are reused for REPRESENTATION_VERSION_TTL seconds, saves made
+by this process drop them right away. Use a shared CACHE_URL when running several processes
+so that invalidations reach all of them, REPRESENTATION_CACHE is only on by default then. Entries live
+at most REPRESENTATION_CACHE_TTL seconds in any case, which bounds how long a representation built
+from rows read during a concurrent update can be served.
+
+Nothing is stored while the current transaction has written tracked rows: it may still roll back,
+and what it reads then would be served once the versions it stamped are the committed ones.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import deepcopy
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.serializers import ListSerializer, ModelSerializer, SerializerMethodField
+from threading import Lock, local
+from . import metrics
+import secrets
+import time
+
+CACHE_KEY_PREFIX = 'common.representations.'
+
+# Concrete models whose rows cached representations are built from
+tracked_models = set()
+
+
+def get_cache():
+    return caches[settings.REPRESENTATION_CACHE_ALIAS]
+
+
+def version_key(model, pk) -> str:
+    return f'{CACHE_KEY_PREFIX}{model._meta.label_lower}.{pk}'
+
+
+def track(serializer_class):
+    """ Registers the models a cached serializer class and its declared nested serializers read """
+    meta = getattr(serializer_class, 'Meta', None)
+
+    if meta is not None and getattr(meta, 'model', None) is not None:
+        tracked_models.add(meta.model._meta.concrete_model)
+
+    for field in getattr(serializer_class, '_declared_fields', {}).values():
+        nested = field.child if isinstance(field, ListSerializer) else field
+
+        if isinstance(nested, ModelSerializer):
+            track(type(nested))
+
+
+class Spec:
+    """ Rows a serializer builds the representation of an instance from """
+
+    def __init__(self, serializer: ModelSerializer, owned: bool = True):
+        model = serializer.Meta.model._meta.concrete_model
+        self.model = model
+        # False for rows extending their owner through a one to one field, versioned with it
+        self.owned = owned
+        self.relations = []  # (source, spec of the related row)
+        keys = []
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+
+            source = field.source
+            nested = field.child if isinstance(field, ListSerializer) else field
+
+            if isinstance(field, SerializerMethodField) or source == '*' or '.' in source:
+                raise ImproperlyConfigured(f'{type(serializer).__name__}.{name} cannot be cached: it does not read a model field')
+
+            try:
+                model_field = model._meta.get_field(source)
+            except FieldDoesNotExist:
+                raise ImproperlyConfigured(f'{type(serializer).__name__}.{name} cannot be cached: {source} is not a field')
+
+            if not model_field.is_relation:
+                keys.append((name, type(field), source))
+                continue
+
+            if isinstance(nested, ModelSerializer) and (model_field.many_to_one or model_field.one_to_one):
+                # Forward relations are rows of their own, reverse one to one rows version their owner
+                spec = Spec(nested, owned=model_field.concrete)
+
+                if spec.model not in tracked_models:
+                    raise ImproperlyConfigured(f'{type(serializer).__name__}.{name} cannot be cached: '
+                                               f'{spec.model.__name__} is not tracked')
+
+                if spec.owned or spec.relations:
+                    self.relations.append((source, spec))
+
+                keys.append((name, type(field), source, spec.key))
+            elif type(field) is PrimaryKeyRelatedField and model_field.many_to_one and model_field.concrete:
+                keys.append((name, type(field), source))
+            else:
+                # Related lists change without any of the rows of the representation changing
+                raise ImproperlyConfigured(f'{type(serializer).__name__}.{name} cannot be cached: unsupported relation')
+
+        self.key = (type(serializer), model, tuple(keys))
+        self.key_prefix = version_key(model, '')
+
+    def rows(self, instance) -> list:
+        """ Version keys of the rows the representation of instance is built from """
+        rows = [f'{self.key_prefix}{instance.pk}'] if self.owned else []
+
+        for source, spec in self.relations:
+            related = getattr(instance, source, None)
+
+            if related is not None:
+                rows += spec.rows(related)
+
+        return rows
+
+
+class LocalCache:
+    """ LRU of representations with the row versions they were built from """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get_many(self, keys: list, stamps: list) -> list:
+        """ Representations of the keys built from rows with the given versions, None when not cached """
+        ttl, now, found = settings.REPRESENTATION_CACHE_TTL, time.monotonic(), []
+
+        with self._lock:
+            for key, stamp in zip(keys, stamps):
+                entry = self._entries.get(key)
+
+                if entry is not None and (entry[1] != stamp or now - entry[0] > ttl):
+                    del self._entries[key]
+                    entry = None
+                elif entry is not None:
+                    self._entries.move_to_end(key)
+
+                found.append(entry[2] if entry is not None else None)
+
+        return found
+
+    def set_many(self, entries: list):
+        """ (key, versions, representation) """
+        now = time.monotonic()
+
+        with self._lock:
+            for key, stamp, representation in entries:
+                self._entries[key] = (now, stamp, representation)
+                self._entries.move_to_end(key)
+
+            while len(self._entries) > settings.REPRESENTATION_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+
+class RepresentationCache:
+    def __init__(self):
+        self._local = LocalCache()
+        # Version key -> (read at, version), saves the shared cache a round trip per row
+        self._versions = {}
+        self._versions_lock = Lock()
+        # Representations looked up in bulk for the list being rendered by this thread
+        self._prefetched = local()
+
+    def spec(self, serializer: ModelSerializer) -> Spec:
+        # Fields are fixed once a serializer renders, the spec is built once per serializer instance
+        spec = serializer.__dict__.get('_representation_spec')
+
+        if spec is None:
+            spec = serializer._representation_spec = Spec(serializer)
+
+        return spec
+
+    def get(self, serializer, instance, build) -> dict:
+        prefetched = getattr(self._prefetched, 'entries', None)
+
+        if prefetched is not None:
+            representation = prefetched.get((id(serializer), instance.pk))
+
+            if representation is not None:
+                return deepcopy(representation)
+
+        return self.get_many(serializer, [instance], build)[0]
+
+    def get_many(self, serializer, instances: list, build, copy: bool = True) -> list[dict]:
+        """ Representations of the instances, built by build(instance) when not cached, with one versions lookup """
+        spec = self.spec(serializer)
+        rows = [spec.rows(instance) for instance in instances]
+        versions = self.versions({key for instance_rows in rows for key in instance_rows})
+
+        keys = [(spec.key, instance.pk) for instance in instances]
+        stamps = [tuple(versions[key] for key in instance_rows) for instance_rows in rows]
+        representations = self._local.get_many(keys, stamps)
+        built = []
+
+        for idx, representation in enumerate(representations):
+            if representation is None:
+                representations[idx] = representation = build(instances[idx])
+                built.append((keys[idx], stamps[idx], representation))
+
+        if built and not writing():
+            self._local.set_many(built)
+
+        metrics.increment('representations.hit', len(instances) - len(built))
+        metrics.increment('representations.miss', len(built))
+
+        # Callers may change what they get, nested objects included, the cached ones stay as built
+        return [deepcopy(representation) for representation in representations] if copy else representations
+
+    def versions(self, keys: set) -> dict:
+        now = time.monotonic()
+        versions = {}
+
+        with self._versions_lock:
+            for key in keys:
+                known = self._versions.get(key)
+
+                if known is not None and now - known[0] <= settings.REPRESENTATION_VERSION_TTL:
+                    versions[key] = known[1]
+
+        missing = keys - versions.keys()
+
+        if not missing:
+            return versions
+
+        cache = get_cache()
+        found = cache.get_many(missing)
+
+        for key in missing - found.keys():
+            # Never reused, entries stamped with a dropped version cannot match again
+            version = secrets.token_hex(8)
+            found[key] = version if cache.add(key, version, None) else cache.get(key, version)
+
+        with self._versions_lock:
+            if len(self._versions) > settings.REPRESENTATION_CACHE_SIZE * 4:
+                self._versions.clear()
+
+            self._versions.update((key, (now, version)) for key, version in found.items())
+
+        versions.update(found)
+        return versions
+
+    def drop(self, keys: list):
+        get_cache().delete_many(keys)
+
+        with self._versions_lock:
+            for key in keys:
+                self._versions.pop(key, None)
+
+    @contextmanager
+    def prefetched(self, instances_by_serializer: dict):
+        """ Serves the representations of {serializer: instances} from one lookup while the block runs """
+        outer = getattr(self._prefetched, 'entries', None)
+        entries = dict(outer) if outer is not None else {}
+
+        for serializer, instances in instances_by_serializer.items():
+            missing = list({
+                instance.pk: instance for instance in instances
+                if (id(serializer), instance.pk) not in entries
+            }.values())
+
+            if missing:
+                # Copied when served
+                for instance, representation in zip(missing, self.get_many(
+                        serializer, missing, serializer.uncached_representation, copy=False)):
+                    entries[(id(serializer), instance.pk)] = representation
+
+        self._prefetched.entries = entries
+
+        try:
+            yield
+        finally:
+            self._prefetched.entries = outer
+
+
+representations = RepresentationCache()
+
+
+class DropOnCommit:
+    """ Drops versions again once the transaction that changed their rows commits """
+
+    def __init__(self, keys: list):
+        self.keys = keys
+
+    def __call__(self):
+        representations.drop(self.keys)
+
+
+def writing() -> bool:
+    """ Whether the transaction of this thread changed tracked rows and is not committed yet """
+    # Callbacks of rolled back transactions and savepoints are discarded along with them
+    return any(
+        connection.in_atomic_block and any(isinstance(func, DropOnCommit) for _, func, _ in connection.run_on_commit)
+        for connection in connections.all(initialized_only=True)
+    )
+
+
+def changed_rows(instance) -> list:
+    """ Version keys to drop when instance changes: its own and those of the rows it extends """
+    model = instance._meta.concrete_model
+    keys = [version_key(model, instance.pk)] if model in tracked_models else []
+
+    for field in model._meta.concrete_fields:
+        if field.one_to_one and field.related_model._meta.concrete_model in tracked_models:
+            related_pk = getattr(instance, field.attname)
+
+            if related_pk is not None:
+                keys.append(version_key(field.related_model._meta.concrete_model, related_pk))
+
+    return keys
+
+
+# No sender filter: saves through proxy models (users_auth.models.TokenUser) are sent with the proxy as sender
+@receiver(post_save)
+@receiver(post_delete)
+def drop_versions(sender, instance, **kwargs):
+    if not settings.REPRESENTATION_CACHE:
+        return
+
+    keys = changed_rows(instance)
+
+    if keys:
+        representations.drop(keys)
+        # Again once committed: other requests may have stamped the old rows with a new version meanwhile
+        transaction.on_commit(DropOnCommit(keys), using=kwargs.get('using'))
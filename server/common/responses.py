@@ -1,4 +1,14 @@
+from django.conf import settings
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+from django.utils.cache import patch_vary_headers
+from .compiled import CompiledListing
+from .compression import ENCODING_HEADER, Compressor, negotiate_encoding
+from .cryptojs import Base64StreamEncoder, StreamEncryptor
+from .payload_keys import get_response_key
 
 
 class NoContentResponse(Response):
@@ -7,3 +17,105 @@ class NoContentResponse(Response):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+
+
+class EncryptedStreamingResponse(StreamingHttpResponse):
+    """
+    Encrypted equivalent of Response(data={key: serializer.data}) for large listings,
+    serializer being a list serializer or a CompiledListing.
+    Rows are serialized one at a time and pushed through AES-CBC and base64 in
+    fixed-size blocks, so memory stays flat regardless of the number of rows.
+    """
+    # JSON is buffered up to this size before being encrypted
+    block_size = 64 * 1024
+
+    # Rows fetched from the database per round trip
+    chunk_size = 500
+
+    def __init__(self, request, serializer, key='data', status=200):
+        # Size is unknown upfront, so the listing is always compressed when the client allows it
+        encoding = negotiate_encoding(request)
+
+        super().__init__(
+            self.stream(request, serializer, key, encoding),
+            status=status,
+            content_type='application/json; charset=utf-8'
+        )
+
+        patch_vary_headers(self, ['X-Payload-Accept-Encoding'])
+
+        if encoding is not None:
+            self[ENCODING_HEADER] = encoding
+
+    def stream(self, request, serializer, key, encoding=None):
+        session_key = get_response_key(request)
+
+        if session_key is not None:
+            encryptor = StreamEncryptor.with_session_key(session_key.key_id, session_key.key)
+        else:
+            encryptor = StreamEncryptor.with_passphrase(settings.PAYLOAD_SECRET)
+
+        encoder = Base64StreamEncoder()
+        compressor = Compressor(encoding) if encoding is not None else None
+
+        for block in self.json_blocks(serializer, key):
+            if compressor is not None:
+                block = compressor.update(block)
+
+            encrypted = encoder.update(encryptor.update(block))
+
+            if encrypted:
+                yield encrypted
+
+        if compressor is not None:
+            yield encoder.update(encryptor.update(compressor.finalize()))
+
+        yield encoder.update(encryptor.finalize()) + encoder.finalize()
+
+    def json_blocks(self, serializer, key):
+        # Same output as JSONRenderer, so clients cannot tell both responses apart
+        json_encoder = encoders.JSONEncoder(
+            ensure_ascii=not api_settings.UNICODE_JSON,
+            allow_nan=not api_settings.STRICT_JSON,
+            separators=(',', ':') if api_settings.COMPACT_JSON else (', ', ': ')
+        )
+        item_separator, key_separator = json_encoder.item_separator, json_encoder.key_separator
+
+        buffer = ['{' + self.encode(json_encoder, key) + key_separator + '[']
+        size = len(buffer[0])
+
+        for idx, row in enumerate(self.rows(serializer)):
+            text = self.encode(json_encoder, row)
+
+            if idx:
+                text = item_separator + text
+
+            buffer.append(text)
+            size += len(text)
+
+            if size >= self.block_size:
+                yield ''.join(buffer).encode()
+                buffer, size = [], 0
+
+        buffer.append(']}')
+        yield ''.join(buffer).encode()
+
+    @staticmethod
+    def encode(json_encoder, value) -> str:
+        # JSONRenderer escapes these too, they end JavaScript string literals
+        return json_encoder.encode(value).replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+    def rows(self, serializer):
+        if isinstance(serializer, CompiledListing):
+            yield from serializer.rows(self.chunk_size)
+            return
+
+        instances = serializer.instance
+
+        if isinstance(instances, QuerySet):
+            instances = instances.iterator(chunk_size=self.chunk_size)
+
+        child = serializer.child
+
+        for instance in instances:
+            yield child.to_representation(instance)
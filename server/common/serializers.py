@@ -1,7 +1,233 @@
-from rest_framework.serializers import ModelSerializer
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Manager, Model, Prefetch, QuerySet, prefetch_related_objects
+from django.db.models.query import ModelIterable
+from rest_framework.serializers import ListSerializer, ModelSerializer, Serializer, SerializerMethodField
+from typing import NamedTuple, Optional
+from .representations import representations, track
 
 
-class DynamicFieldsModelSerializer(ModelSerializer):
+class QueryPlan(NamedTuple):
+    select_related: list
+    prefetch_related: list
+    # None when some field reads something the plan cannot tell, everything is loaded then
+    only: Optional[list]
+
+
+def plan_queries(serializer: ModelSerializer, model) -> QueryPlan:
+    """
+    Relations the field tree of a model serializer goes through: single related objects
+    are joined, related lists are prefetched with querysets planned the same way.
+    """
+    select, prefetch, only = [], [], [model._meta.pk.name]
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+
+        many = isinstance(field, ListSerializer)
+        nested = field.child if many else field
+        source = field.source
+
+        if isinstance(field, SerializerMethodField) or source == '*' or '.' in source:
+            only = None
+            continue
+
+        try:
+            model_field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            # Property or method of the model
+            only = None
+            continue
+
+        if not model_field.is_relation:
+            if only is not None:
+                only.append(source)
+            continue
+
+        if not isinstance(nested, ModelSerializer):
+            # Primary key or string of the related object, its column is on this model if concrete
+            if model_field.concrete and only is not None:
+                only.append(source)
+            elif not model_field.concrete:
+                only = None
+            continue
+
+        if model_field.one_to_many or model_field.many_to_many:
+            prefetch.append(Prefetch(source, queryset=planned(
+                nested, model_field.related_model._default_manager.all(), model_field)))
+            continue
+
+        # Forward or reverse single related object
+        child = plan_queries(nested, model_field.related_model)
+        select.append(source)
+        select.extend(f'{source}__{path}' for path in child.select_related)
+        prefetch.extend(
+            Prefetch(f'{source}__{lookup.prefetch_through}', queryset=lookup.queryset)
+            for lookup in child.prefetch_related
+        )
+
+        if model_field.concrete and only is not None:
+            only.append(source)
+
+        if child.only is None:
+            only = None
+        elif only is not None:
+            only.extend(f'{source}__{path}' for path in child.only)
+
+    return QueryPlan(select, prefetch, only)
+
+
+def planned(serializer: ModelSerializer, queryset: QuerySet, reverse_relation=None) -> QuerySet:
+    plan = plan_queries(serializer, queryset.model)
+
+    if plan.select_related:
+        queryset = queryset.select_related(*plan.select_related)
+
+    # Lookups set up by the view win
+    existing = {
+        lookup.prefetch_to if isinstance(lookup, Prefetch) else lookup
+        for lookup in queryset._prefetch_related_lookups
+    }
+    prefetches = [lookup for lookup in plan.prefetch_related if lookup.prefetch_to not in existing]
+
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches)
+
+    # Columns restricted by the view are left alone
+    if plan.only is not None and queryset.query.deferred_loading == (frozenset(), True):
+        only = plan.only
+
+        if reverse_relation is not None and reverse_relation.one_to_many:
+            # Prefetched rows are matched to their parent through this column
+            only = only + [reverse_relation.field.name]
+
+        queryset = queryset.only(*only)
+
+    # Rows of a related manager (user.team_members.all()) are attached to its instance through
+    # these columns, which would otherwise be loaded again one row at a time
+    names, defer = queryset.query.deferred_loading
+
+    if not defer:
+        missing = [field.name for field in queryset._known_related_objects if field.name not in names]
+
+        if missing:
+            queryset = queryset.only(*names, *missing)
+
+    return queryset
+
+
+def plan_instance(serializer: ModelSerializer, instance):
+    """ Queryset given to the serializer with the planned joins and prefetches, instances get the prefetches """
+    model = serializer.Meta.model
+
+    if isinstance(instance, QuerySet):
+        # Querysets that are evaluated, return values or combine queries are used as they are
+        if (instance.model is not model or instance._result_cache is not None
+                or instance._iterable_class is not ModelIterable or instance.query.combinator):
+            return instance
+
+        return planned(serializer, instance)
+
+    instances = [instance] if isinstance(instance, Model) else instance
+
+    if isinstance(instances, list) and instances and all(isinstance(obj, model) for obj in instances):
+        plan = plan_queries(serializer, model)
+        # Relations already loaded are skipped
+        prefetch_related_objects(instances, *plan.select_related, *plan.prefetch_related)
+
+    return instance
+
+
+def collect_cached(serializer, instances: list, found: dict):
+    """ {cached serializer: instances it renders} under serializer, through loaded relations only """
+    if isinstance(serializer, CachedRepresentationMixin):
+        found.setdefault(serializer, []).extend(instances)
+        return
+
+    for field in serializer.fields.values():
+        many = isinstance(field, ListSerializer)
+        nested = field.child if many else field
+
+        if field.write_only or not isinstance(nested, Serializer) or field.source == '*' or '.' in field.source:
+            continue
+
+        related = []
+
+        for instance in instances:
+            if many:
+                # Lists that are not prefetched would be queried twice
+                related.extend(getattr(instance, '_prefetched_objects_cache', {}).get(field.source, ()))
+            else:
+                value = field.get_attribute(instance)
+
+                if value is not None:
+                    related.append(value)
+
+        if related:
+            collect_cached(nested, related, found)
+
+
+class RepresentationListSerializer(ListSerializer):
+    """ Looks up the cached representations nested in the rows at once before rendering them """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, Manager) else data
+
+        if not settings.REPRESENTATION_CACHE:
+            return super().to_representation(iterable)
+
+        instances = list(iterable)
+
+        if isinstance(self.child, CachedRepresentationMixin):
+            return representations.get_many(self.child, instances, self.child.uncached_representation)
+
+        found = {}
+        collect_cached(self.child, instances, found)
+
+        with representations.prefetched(found):
+            return super().to_representation(instances)
+
+
+class RepresentationListMixin:
+    """ many=True renders through RepresentationListSerializer unless Meta sets another list serializer """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        meta = cls.__dict__.get('Meta')
+
+        if meta is not None and not hasattr(meta, 'list_serializer_class'):
+            meta.list_serializer_class = RepresentationListSerializer
+
+
+class CachedRepresentationMixin(RepresentationListMixin):
+    """
+    Model serializer whose representations are reused until one of the rows they are built
+    from changes (see common.representations). Only model fields, primary keys and single
+    related objects rendered by nested model serializers can be cached.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        track(cls)
+
+    def to_representation(self, instance):
+        if not settings.REPRESENTATION_CACHE:
+            return self.uncached_representation(instance)
+
+        return representations.get(self, instance, self.uncached_representation)
+
+    def uncached_representation(self, instance):
+        return super().to_representation(instance)
+
+
+class DynamicFieldsModelSerializer(RepresentationListMixin, ModelSerializer):
+    """
+    Model serializer whose fields can be replaced at runtime. The queryset or instances it is
+    given are loaded with the joins and prefetches its effective field tree needs, so nested
+    listings run a constant number of queries (see plan_queries).
+    """
+
     def __init__(self, *args, **kwargs):
         fields = kwargs.pop('fields', None)
         empty = kwargs.pop('empty', False)
@@ -14,3 +240,34 @@ class DynamicFieldsModelSerializer(ModelSerializer):
         if fields is not None:
             for related_name in fields:
                 self.fields[related_name] = fields[related_name]
+
+        # With many=True this is the child, which also receives the instances. Querysets are
+        # planned by many_init instead since the list serializer holds its own reference
+        if self.instance is not None and not isinstance(self.instance, QuerySet):
+            self.instance = plan_instance(self, self.instance)
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_serializer = super().many_init(*args, **kwargs)
+
+        if isinstance(list_serializer.instance, QuerySet):
+            list_serializer.instance = plan_instance(list_serializer.child, list_serializer.instance)
+
+        return list_serializer
+
+
+class FlattenedModelSerializer(ModelSerializer):
+    """ Model serializer moving keys of nested objects into its own representation """
+    # Nested field -> keys moved out of it, in order, None for all of them
+    flatten = {}
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+
+        for name, keys in self.flatten.items():
+            nested = representation.pop(name)
+
+            for key in (nested if keys is None else keys):
+                representation[key] = nested[key]
+
+        return representation
@@ -0,0 +1,221 @@
+"""
+Session engine (SESSION_ENGINE = 'common.sessions') keeping sessions in a per-process
+LRU in front of the database, optionally backed by a shared cache so that other
+processes do not go to the database either (SESSION_SHARED_CACHE).
+
+Local entries live at most SESSION_LOCAL_CACHE_TTL seconds, which bounds how long
+a session deleted by another process (logout) can still be seen here.
+
+With SESSION_WRITE_BEHIND, updates that do not change the authenticated user
+(last activity, payload keys, ...) are saved to the caches right away and to the
+database in the background. Logins, logouts and new sessions are always written through.
+"""
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends import db
+from django.contrib.sessions.backends.base import UpdateError
+from django.core.cache import caches
+from django.db import connections
+from django.utils import timezone
+from threading import Event, Lock, Thread
+from typing import Optional
+from . import metrics
+import atexit
+import time
+
+AUTH_KEYS = (SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY)
+CACHE_KEY_PREFIX = 'common.sessions.'
+
+
+class LocalCache:
+    """ LRU of decoded sessions with a TTL """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, session_key: str) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(session_key)
+
+            if entry is None:
+                return None
+
+            cached_at, data, expire_date = entry
+
+            if time.monotonic() - cached_at > settings.SESSION_LOCAL_CACHE_TTL:
+                del self._entries[session_key]
+                return None
+
+            self._entries.move_to_end(session_key)
+            return data, expire_date
+
+    def set(self, session_key: str, data: dict, expire_date):
+        with self._lock:
+            self._entries[session_key] = (time.monotonic(), data, expire_date)
+            self._entries.move_to_end(session_key)
+
+            while len(self._entries) > settings.SESSION_LOCAL_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def delete(self, session_key: str):
+        with self._lock:
+            self._entries.pop(session_key, None)
+
+
+class WriteBehind:
+    """ Session updates waiting to be written to the database by a background thread """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._thread = None
+
+    def add(self, session_key: str, data: dict):
+        with self._lock:
+            self._pending[session_key] = data
+            size = len(self._pending)
+
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='session-write-behind', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+        metrics.set_gauge('sessions.write_behind.pending', size)
+
+        if size >= settings.SESSION_WRITE_BEHIND_MAX_PENDING:
+            self._wakeup.set()
+
+    def discard(self, session_key: str):
+        with self._lock:
+            self._pending.pop(session_key, None)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        for session_key, data in pending.items():
+            store = SessionStore(session_key)
+            store._session_cache = data
+
+            try:
+                # Plain database save, bypassing the caches which are already up to date
+                db.SessionStore.save(store)
+                metrics.increment('sessions.write_behind.flushed')
+            except UpdateError:
+                # Deleted in the meantime
+                pass
+            except Exception:
+                metrics.increment('sessions.write_behind.errors')
+
+        metrics.set_gauge('sessions.write_behind.pending', len(self._pending))
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(settings.SESSION_WRITE_BEHIND_INTERVAL)
+            self._wakeup.clear()
+
+            try:
+                self.flush()
+            finally:
+                # Connections are per thread, do not keep this one open between flushes
+                connections.close_all()
+
+
+_local = LocalCache()
+_write_behind = WriteBehind()
+
+
+class SessionStore(db.SessionStore):
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        # Authentication keys as loaded, decides whether a save can be written behind
+        self._loaded_auth = None
+
+    @property
+    def shared_cache(self):
+        return caches[settings.SESSION_CACHE_ALIAS] if settings.SESSION_SHARED_CACHE else None
+
+    def load(self):
+        session_key = self.session_key
+        entry = self.get_cached(session_key) if session_key else None
+
+        if entry is not None:
+            data, expire_date = entry
+
+            if expire_date > timezone.now():
+                metrics.increment('sessions.cache_hit')
+                data = dict(data)
+                self.remember_auth(data)
+                return data
+
+        metrics.increment('sessions.db_load')
+        session = self._get_session_from_db()
+
+        if session is None:
+            return {}
+
+        data = self.decode(session.session_data)
+        self.cache(session.session_key, data, session.expire_date)
+        self.remember_auth(data)
+
+        return data
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+
+        data = self._get_session(no_load=must_create)
+
+        if not must_create and settings.SESSION_WRITE_BEHIND and self.auth_unchanged(data):
+            _write_behind.add(self.session_key, dict(data))
+            metrics.increment('sessions.write_behind')
+        else:
+            # Anything pending for this session is older than what is written now
+            _write_behind.discard(self.session_key)
+            super().save(must_create=must_create)
+
+        self.cache(self.session_key, data, self.get_expiry_date())
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            session_key = self.session_key
+
+        if session_key is None:
+            return
+
+        _write_behind.discard(session_key)
+        _local.delete(session_key)
+
+        if self.shared_cache is not None:
+            self.shared_cache.delete(CACHE_KEY_PREFIX + session_key)
+
+        super().delete(session_key)
+
+    def get_cached(self, session_key: str) -> Optional[tuple]:
+        entry = _local.get(session_key)
+
+        if entry is None and self.shared_cache is not None:
+            entry = self.shared_cache.get(CACHE_KEY_PREFIX + session_key)
+
+            if entry is not None:
+                _local.set(session_key, *entry)
+
+        return entry
+
+    def cache(self, session_key: str, data: dict, expire_date):
+        data = dict(data)
+        _local.set(session_key, data, expire_date)
+
+        if self.shared_cache is not None:
+            timeout = max(1, int((expire_date - timezone.now()).total_seconds()))
+            self.shared_cache.set(CACHE_KEY_PREFIX + session_key, (data, expire_date), timeout)
+
+    def remember_auth(self, data: dict):
+        self._loaded_auth = {key: data.get(key) for key in AUTH_KEYS}
+
+    def auth_unchanged(self, data: dict) -> bool:
+        return self._loaded_auth is not None and all(
+            data.get(key) == self._loaded_auth[key] for key in AUTH_KEYS)
@@ -0,0 +1,7 @@
+from django.urls import path
+from .views import *
+
+urlpatterns = [
+    path('/batch', Batch.as_view()),
+    path('/metrics', Metrics.as_view()),
+]
@@ -0,0 +1,117 @@
+from django.conf import settings
+from django.http import QueryDict, StreamingHttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.decorators import method_decorator
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from common.decorators import admin_required, body
+from common.exceptions import BadRequest
+from common import metrics
+from io import BytesIO
+import copy
+import json
+
+BATCH_METHODS = {'GET', 'POST', 'PUT', 'PATCH', 'DELETE'}
+
+
+@method_decorator(admin_required, name="dispatch")
+class Metrics(APIView):
+    def get(self, request):
+        return Response(data=metrics.snapshot())
+
+
+class Batch(APIView):
+    """
+    Run several API calls with one encrypted round trip.
+    Sub-requests are dispatched in-process and share the session of the batch request.
+    """
+
+    @body({'requests'})
+    def post(self, request):
+        operations = request.data['requests']
+
+        if not isinstance(operations, list) or not operations:
+            raise BadRequest(message='requests should be a non-empty list')
+
+        if len(operations) > settings.BATCH_MAX_OPERATIONS:
+            raise BadRequest(
+                message=f'At most {settings.BATCH_MAX_OPERATIONS} requests can be batched')
+
+        # Checked before anything runs, a malformed batch has no partial effects
+        for operation in operations:
+            if isinstance(operation, dict) and not isinstance(operation.get('params') or {}, dict):
+                raise BadRequest(message='params should be an object')
+
+        metrics.increment('batch.operations', len(operations))
+
+        return Response(data=[self.dispatch_operation(request, operation) for operation in operations])
+
+    def dispatch_operation(self, request, operation):
+        if not isinstance(operation, dict) or not isinstance(operation.get('path'), str):
+            return {'status': 400, 'data': {'message': 'path is required'}}
+
+        method = str(operation.get('method', 'GET')).upper()
+        path = operation['path']
+
+        if method not in BATCH_METHODS:
+            return {'status': 405, 'data': {'message': 'Method not allowed'}}
+
+        try:
+            match = resolve(path)
+        except Resolver404:
+            return {'status': 404, 'data': {'message': 'Not found'}}
+
+        if getattr(match.func, 'view_class', None) is Batch:
+            return {'status': 400, 'data': {'message': 'Batches cannot be nested'}}
+
+        sub_request = self.build_sub_request(
+            request._request, method, path,
+            operation.get('params') or {}, operation.get('body')
+        )
+        sub_request.resolver_match = match
+
+        try:
+            response = match.func(sub_request, *match.args, **match.kwargs)
+        except Exception:
+            # One failing call should not take down the rest of the batch
+            metrics.increment('batch.errors')
+            return {'status': 500, 'data': {'message': 'Could not perform the task. There is some problem.'}}
+
+        if isinstance(response, Response):
+            return {'status': response.status_code, 'data': response.data}
+
+        if isinstance(response, StreamingHttpResponse):
+            return {'status': 400, 'data': {'message': 'This endpoint cannot be batched'}}
+
+        return {'status': response.status_code, 'data': response.content.decode()}
+
+    def build_sub_request(self, django_request, method, path, params, data):
+        sub_request = copy.copy(django_request)
+
+        # Request body is handed over as plain JSON, which CryptoParser accepts as is
+        content = json.dumps(data).encode() if data is not None else b''
+
+        sub_request.method = method
+        sub_request.path = sub_request.path_info = path
+        sub_request.GET = QueryDict(mutable=True)
+
+        for key, value in params.items():
+            sub_request.GET[key] = str(value)
+
+        sub_request.META = dict(django_request.META)
+        sub_request.META.update({
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': sub_request.GET.urlencode(),
+            'CONTENT_TYPE': 'text/plain',
+            'CONTENT_LENGTH': str(len(content)),
+        })
+        sub_request.META.pop('HTTP_X_PAYLOAD_ENCODING', None)
+
+        for attr in ('_body', '_post', '_files'):
+            sub_request.__dict__.pop(attr, None)
+
+        sub_request._stream = BytesIO(content)
+        sub_request._read_started = False
+
+        return sub_request
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class ContestsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'contests'
+
+    def ready(self):
+        # Registers the cached representations
+        from . import serializers  # noqa: F401
@@ -1,10 +1,10 @@
 from rest_framework.serializers import ModelSerializer
 from .models import Contest, SoloContestRegistration, TeamContestRegistration, TeamContestUserRegistration
 from users.serializers import UserSerializer
-from common.serializers import DynamicFieldsModelSerializer
+from common.serializers import CachedRepresentationMixin, DynamicFieldsModelSerializer
 
 
-class ContestSerializer(ModelSerializer):
+class ContestSerializer(CachedRepresentationMixin, ModelSerializer):
     class Meta:
         model = Contest
         exclude = ['is_solo']
@@ -1,22 +1,20 @@
 from django.contrib.auth.models import User
 from django.utils.decorators import method_decorator
-from django.core.mail import send_mail
+from django.db import transaction
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.exceptions import NotFound
+from common.compiled import CompiledSerializer
 from common.decorators import login_required, body
-from common.responses import NoContentResponse
+from common.responses import NoContentResponse, EncryptedStreamingResponse
 from common.exceptions import BadRequest, Conflict
+from outbox.helpers import enqueue_mail
 from contests.helpers import get_contest, get_team_reg, get_contest_registration_email_message, get_team_contest_registration_email_message
 from users.serializers import AuthUserSerializer
 from teams.helpers import get_team
 from teams.serializers import TeamSerializer
 from .models import SoloContestRegistration as SoloContestRegistrationModel, TeamContestRegistration as TeamContestRegistrationModel, TeamContestUserRegistration
 from .serializers import SoloContestRegistrationSerializer, TeamContestRegistrationSerializer, TeamContestUserRegistrationSerializer
-import environ
-
-env = environ.Env()
-environ.Env.read_env()
 
 
 @method_decorator(login_required, name="dispatch")
@@ -49,28 +47,26 @@ class SoloContestRegistration(APIView):
         if solo_reg_exists:
             raise Conflict(message='User already registered for the contest.')
 
-        solo_reg = SoloContestRegistrationModel(
-            user=request.user,
-            contest=contest
-        )
-        solo_reg.save()
+        with transaction.atomic():
+            solo_reg = SoloContestRegistrationModel(
+                user=request.user,
+                contest=contest
+            )
+            solo_reg.save()
+
+            # Confirmation is delivered by the outbox worker, only if the registration is committed
+            mail = get_contest_registration_email_message(
+                request.user.first_name,
+                contest.contest_slug,
+                contest.club_slug
+            )
 
-        # Send email notification for successful registration
-        try:
-            send_mail(
+            enqueue_mail(
                 subject=f'Moksha IX - Registration Confirmation for {contest.contest_slug}',
-                message=get_contest_registration_email_message(
-                    request.user.first_name,
-                    contest.contest_slug,
-                    contest.club_slug
-                ),
-                from_email=env('EMAIL_HOST_USER'),
+                message=mail.text,
+                html_message=mail.html,
                 recipient_list=[request.user.email],
-                fail_silently=False,
             )
-        except Exception as e:
-            # Log the error but don't fail the registration process
-            pass
 
         serializer = SoloContestRegistrationSerializer(solo_reg)
         return Response(data=serializer.data, status=201)
@@ -127,47 +123,41 @@ class TeamContestRegistration(APIView):
         team = get_team(team_id)
         contest = get_contest(contest_id)
 
-        team_reg = TeamContestRegistrationModel(team=team, contest=contest)
-        team_reg.save()
+        with transaction.atomic():
+            team_reg = TeamContestRegistrationModel(team=team, contest=contest)
+            team_reg.save()
+
+            team_reg_members = []
+
+            for member_id in selected_members:
+                team_reg_members.append(TeamContestUserRegistration(
+                    team_contest_registration=team_reg,
+                    user=User.objects.get(id=member_id)
+                ))
 
-        team_reg_members = []
+            TeamContestUserRegistration.objects.bulk_create(team_reg_members)
 
-        for member_id in selected_members:
-            team_reg_members.append(TeamContestUserRegistration(
-                team_contest_registration=team_reg,
-                user=User.objects.get(id=member_id)
-            ))
+            # Confirmations are delivered by the outbox worker, only if the registration is committed
+            for member in team_reg_members:
+                mail = get_team_contest_registration_email_message(
+                    member.user.first_name,
+                    team.team_name,
+                    contest.contest_slug,
+                    contest.club_slug
+                )
 
-        TeamContestUserRegistration.objects.bulk_create(team_reg_members)
+                enqueue_mail(
+                    subject=f'Moksha IX - Team Registration Confirmation for {contest.contest_slug}',
+                    message=mail.text,
+                    html_message=mail.html,
+                    recipient_list=[member.user.email],
+                )
 
         team_reg = get_team_reg(team_id, contest_id)
 
         if team_reg is None:
             return Response({'data': None, 'message': 'No registration found.'})
 
-        # Send email notifications to all team members
-        try:
-            # Get all user objects for the selected members
-            member_users = User.objects.filter(id__in=selected_members).all()
-
-            # Send emails to all team members
-            for user in member_users:
-                send_mail(
-                    subject=f'Moksha IX - Team Registration Confirmation for {contest.contest_slug}',
-                    message=get_team_contest_registration_email_message(
-                        user.first_name,
-                        team.team_name,
-                        contest.contest_slug,
-                        contest.club_slug
-                    ),
-                    from_email=env('EMAIL_HOST_USER'),
-                    recipient_list=[user.email],
-                    fail_silently=False,
-                )
-        except Exception as e:
-            # Log the error but don't fail the registration process
-            pass
-
         serializer = TeamContestRegistrationSerializer(
             team_reg,
             fields={'registered_members': TeamContestUserRegistrationSerializer(
@@ -197,6 +187,24 @@ class TeamContestRegistration(APIView):
 # No role-based auth is implemented yet
 
 
+# AuthUserSerializer is used here to get email and phone for admin client
+SOLO_REGISTRATIONS = CompiledSerializer(lambda: SoloContestRegistrationSerializer(
+    empty=True,
+    fields={'user': AuthUserSerializer()}
+))
+
+TEAM_REGISTRATIONS = CompiledSerializer(lambda: TeamContestRegistrationSerializer(
+    empty=True,
+    fields={
+        'team': TeamSerializer(),
+        'registered_members': TeamContestUserRegistrationSerializer(
+            many=True,
+            fields={'user': AuthUserSerializer()}
+        )
+    }
+))
+
+
 class GetContestRegistrations(APIView):
     def get(self, request, club_slug, contest_slug):
         contest_type = request.GET.get('type', None)
@@ -208,32 +216,10 @@ class GetContestRegistrations(APIView):
             data = SoloContestRegistrationModel.objects.filter(
                 contest__club_slug=club_slug, contest__contest_slug=contest_slug).all()
 
-            serializer = SoloContestRegistrationSerializer(
-                data,
-                many=True,
-                empty=True,
-                # AuthUserSerializer is used here to get email and phone for admin client
-                fields={'user': AuthUserSerializer()}
-            )
-
-            return Response({'data': serializer.data})
+            return EncryptedStreamingResponse(request, SOLO_REGISTRATIONS(data))
 
         else:
             data = TeamContestRegistrationModel.objects.filter(
                 contest__club_slug=club_slug, contest__contest_slug=contest_slug).all()
 
-            serializer = TeamContestRegistrationSerializer(
-                data,
-                many=True,
-                empty=True,
-                fields={
-                    'team': TeamSerializer(),
-                    'registered_members': TeamContestUserRegistrationSerializer(
-                        many=True,
-                        # AuthUserSerializer is used here to get email and phone for admin client
-                        fields={'user': AuthUserSerializer()}
-                    )
-                }
-            )
-
-            return Response({'data': serializer.data})
+            return EncryptedStreamingResponse(request, TEAM_REGISTRATIONS(data))
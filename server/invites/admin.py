@@ -1,4 +1,5 @@
 from django.contrib import admin
 from .models import *
 admin.site.register(Invite)
+admin.site.register(InviteNotification)
 # Register your models here.
@@ -1,14 +1,10 @@
 from django.contrib.auth.models import User
 from rest_framework.exceptions import PermissionDenied, NotFound
 from typing import Optional
-import textwrap
-import environ
+from outbox.templates import RenderedMail, render
 from .models import Invite
 from teams.models import Team
 
-env = environ.Env()
-environ.Env.read_env()
-
 
 def verify_team_leader(team: Optional[Team], auth_user: User):
     if team is None:
@@ -26,21 +22,30 @@ def verify_invite(invite: Optional[Invite]) -> Invite:
     return invite
 
 
-def get_team_invitation_email_message(invited_user_first_name, team_name, leader_first_name, leader_last_name):
+def get_team_invitation_email_message(invited_user_first_name, team_name, leader_first_name, leader_last_name) -> RenderedMail:
     """
     Generate email message for team invitation.
     """
-    return textwrap.dedent(f'''\
-        Hi {invited_user_first_name},
-
-        You have been invited to join team "{team_name}" by {leader_first_name} {leader_last_name} for Moksha IX – 2025.
-
-        To accept or reject this invitation, please log in to your Moksha account and check your team invitations.
+    return render(
+        'team_invitation',
+        first_name=invited_user_first_name,
+        team_name=team_name,
+        leader_first_name=leader_first_name,
+        leader_last_name=leader_last_name
+    )
 
-        Joining a team will allow you to participate in team contests together. If you have any questions about this invitation,
-        you can contact the team leader directly or reach out to us at {env('EMAIL_HOST_USER')}.
 
-        Best regards,
-        Moksha IX Tech Team
-        National Institute of Technology, Agartala
-    ''')
+def get_team_invitation_digest_email_message(invited_user_first_name, invitations) -> RenderedMail:
+    """
+    Generate a single email message for several team invitations.
+    `invitations` is a list of (team_name, leader_first_name, leader_last_name).
+    """
+    return render(
+        'team_invitation_digest',
+        first_name=invited_user_first_name,
+        count=len(invitations),
+        invitations='\n'.join(
+            f'- "{team_name}" by {leader_first_name} {leader_last_name}'
+            for team_name, leader_first_name, leader_last_name in invitations
+        )
+    )
@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+from common import metrics
+from invites.helpers import get_team_invitation_email_message, get_team_invitation_digest_email_message
+from invites.models import InviteNotification
+from outbox.helpers import enqueue_mail
+from datetime import timedelta
+import time
+
+
+class Command(BaseCommand):
+    help = 'Queue one mail per recipient for the invites received during the digest window'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Queue the digests that are due and exit instead of polling')
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Recipients handled per transaction')
+        parser.add_argument(
+            '--poll-interval', type=float, default=30.0,
+            help='Seconds to wait when no digest is due')
+
+    def handle(self, *args, **options):
+        while True:
+            if self.process_batch(options['batch_size']):
+                continue
+
+            if options['once']:
+                break
+
+            time.sleep(options['poll_interval'])
+
+    def process_batch(self, batch_size: int) -> int:
+        cutoff = timezone.now() - timedelta(seconds=settings.INVITE_DIGEST_WINDOW_SECONDS)
+
+        # A recipient is due once their oldest pending invite has waited for a whole window
+        due_users = list(
+            InviteNotification.objects
+            .filter(digested_at__isnull=True)
+            .values('invite__user')
+            .annotate(oldest=Min('created_at'))
+            .filter(oldest__lte=cutoff)
+            .order_by('oldest')
+            .values_list('invite__user', flat=True)[:batch_size]
+        )
+
+        if not due_users:
+            return 0
+
+        with transaction.atomic():
+            notifications = list(
+                InviteNotification.objects
+                .select_for_update(skip_locked=True, of=('self',))
+                .filter(digested_at__isnull=True, invite__user__in=due_users)
+                .select_related('invite__user', 'invite__team__leader')
+                .order_by('created_at')
+            )
+
+            by_user = {}
+
+            for notification in notifications:
+                by_user.setdefault(notification.invite.user, []).append(notification)
+
+            for user, pending in by_user.items():
+                self.enqueue_digest(user, [notification.invite for notification in pending])
+
+            digested_at = timezone.now()
+
+            for notification in notifications:
+                notification.digested_at = digested_at
+
+            InviteNotification.objects.bulk_update(notifications, fields=['digested_at'])
+
+        metrics.increment('invites.digests', len(by_user))
+        metrics.increment('invites.digested_notifications', len(notifications))
+
+        return len(by_user)
+
+    def enqueue_digest(self, user, invites):
+        # A single invite keeps the regular invitation mail
+        if len(invites) == 1:
+            team = invites[0].team
+            subject = f'Moksha IX - Team Invitation for {team.team_name}'
+            mail = get_team_invitation_email_message(
+                user.first_name,
+                team.team_name,
+                team.leader.first_name,
+                team.leader.last_name
+            )
+        else:
+            subject = f'Moksha IX - {len(invites)} new team invitations'
+            mail = get_team_invitation_digest_email_message(
+                user.first_name,
+                [(invite.team.team_name, invite.team.leader.first_name, invite.team.leader.last_name) for invite in invites]
+            )
+
+        enqueue_mail(
+            subject=subject,
+            message=mail.text,
+            html_message=mail.html,
+            recipient_list=[user.email],
+        )
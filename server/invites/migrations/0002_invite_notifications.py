@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invites', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InviteNotification',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('digested_at', models.DateTimeField(null=True)),
+                ('invite', models.ForeignKey(db_column='invite', on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='invites.invite')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['digested_at', 'created_at'], name='invite_notification_due_idx')],
+            },
+        ),
+    ]
@@ -1,5 +1,5 @@
 from django.contrib.auth.models import User
-from django.db.models import Model, AutoField, ForeignKey, CASCADE
+from django.db.models import Model, AutoField, ForeignKey, DateTimeField, Index, CASCADE
 from enum import StrEnum
 from teams.models import Team
 
@@ -25,3 +25,23 @@ class Invite(Model):
 
     def __str__(self):
         return str(self.id)
+
+
+class InviteNotification(Model):
+    """ Pending mail about an invite, merged with the recipient's other invites by send_invite_digests """
+    id = AutoField(primary_key=True)
+    invite = ForeignKey(
+        Invite,
+        related_name='notifications',
+        on_delete=CASCADE, null=False, db_column='invite'
+    )
+    created_at = DateTimeField(auto_now_add=True)
+    digested_at = DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            Index(fields=['digested_at', 'created_at'], name='invite_notification_due_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.id)
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class OutboxConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'outbox'
+
+    def ready(self):
+        # Templates are compiled once at startup rather than on the first mail
+        from .templates import load_templates
+        load_templates()
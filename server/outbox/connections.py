@@ -0,0 +1,111 @@
+"""
+Per-process pool of open mail backend connections used by the outbox worker.
+SMTP connections stay authenticated between batches, they are health-checked
+when taken out of the pool and recycled after a maximum age or message count.
+"""
+from django.conf import settings
+from django.core.mail import get_connection
+from threading import Lock
+from common import metrics
+import time
+
+
+class PooledConnection:
+    def __init__(self, backend):
+        self.backend = backend
+        self.opened_at = time.monotonic()
+        self.sent = 0
+
+    def send_messages(self, messages) -> int:
+        sent = self.backend.send_messages(messages) or 0
+        self.sent += len(messages)
+        return sent
+
+    def expired(self) -> bool:
+        return (
+            time.monotonic() - self.opened_at > settings.OUTBOX_SMTP_MAX_AGE_SECONDS
+            or self.sent >= settings.OUTBOX_SMTP_MAX_MESSAGES
+        )
+
+    def alive(self) -> bool:
+        # Only the SMTP backend keeps a socket around, other backends are always usable
+        smtp = getattr(self.backend, 'connection', None)
+
+        if smtp is None:
+            return True
+
+        try:
+            return smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def close(self):
+        try:
+            self.backend.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: list[PooledConnection] = []
+        self._lock = Lock()
+
+    def acquire(self) -> PooledConnection:
+        while True:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+
+            if connection is None:
+                break
+
+            if not connection.expired() and connection.alive():
+                metrics.increment('outbox.smtp.reused')
+                return connection
+
+            metrics.increment('outbox.smtp.recycled')
+            connection.close()
+
+        backend = get_connection(fail_silently=False)
+        backend.open()
+        metrics.increment('outbox.smtp.opened')
+
+        return PooledConnection(backend)
+
+    def release(self, connection: PooledConnection):
+        if connection.expired():
+            metrics.increment('outbox.smtp.recycled')
+            connection.close()
+            return
+
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(connection)
+                return
+
+        connection.close()
+
+    def discard(self, connection: PooledConnection):
+        connection.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for connection in idle:
+            connection.close()
+
+
+_lock = Lock()
+_pool = None
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+
+    with _lock:
+        if _pool is None:
+            _pool = ConnectionPool(settings.OUTBOX_SMTP_POOL_SIZE)
+
+    return _pool
@@ -0,0 +1,17 @@
+from django.conf import settings
+from .models import OutboxMessage
+
+
+def enqueue_mail(subject: str, message: str, recipient_list: list[str], from_email: str = None, html_message: str = None) -> OutboxMessage:
+    """
+    Drop-in replacement for send_mail. The message is stored in the outbox and
+    sent by the send_outbox worker, call it inside the transaction of the change
+    it notifies about so both are committed (or rolled back) together.
+    """
+    return OutboxMessage.objects.create(
+        subject=subject,
+        body=message,
+        html_body=html_message,
+        from_email=from_email or settings.EMAIL_HOST_USER,
+        recipients=list(recipient_list),
+    )
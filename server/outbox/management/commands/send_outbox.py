@@ -0,0 +1,129 @@
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from common import metrics
+from outbox.connections import get_pool
+from outbox.models import OutboxMessage, OutboxStatus
+from datetime import timedelta
+import time
+
+
+class Command(BaseCommand):
+    help = 'Deliver the mails queued in the outbox, retrying failures with exponential backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Deliver the mails that are due and exit instead of polling')
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE,
+            help='Mails claimed per transaction')
+        parser.add_argument(
+            '--poll-interval', type=float, default=5.0,
+            help='Seconds to wait when the outbox is empty')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                processed = self.process_batch(options['batch_size'])
+
+                if processed:
+                    # Keep going while there is a backlog
+                    continue
+
+                if options['once']:
+                    break
+
+                time.sleep(options['poll_interval'])
+        finally:
+            get_pool().close_all()
+
+    def process_batch(self, batch_size: int) -> int:
+        # Rows locked by another worker are skipped, so several workers can run side by side
+        with transaction.atomic():
+            messages = list(
+                OutboxMessage.objects
+                .select_for_update(skip_locked=True)
+                .filter(status=OutboxStatus.PENDING, next_attempt_at__lte=timezone.now())
+                .order_by('next_attempt_at')[:batch_size]
+            )
+
+            if not messages:
+                return 0
+
+            self.deliver(messages)
+
+            OutboxMessage.objects.bulk_update(
+                messages, fields=['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'])
+
+        return len(messages)
+
+    def deliver(self, messages: list[OutboxMessage]):
+        """ Sends the whole batch over one pooled connection, replaced only if it breaks """
+        pool = get_pool()
+        connection = None
+
+        try:
+            for idx, message in enumerate(messages):
+                if connection is None:
+                    try:
+                        connection = pool.acquire()
+                    except Exception as error:
+                        # Server unreachable, no point in retrying the rest of the batch right away
+                        for remaining in messages[idx:]:
+                            self.failed(remaining, error)
+                        return
+
+                try:
+                    connection.send_messages([self.build(message)])
+                except Exception as error:
+                    self.failed(message, error)
+
+                    # Refused recipients leave the session usable, dropped connections do not
+                    if not connection.alive():
+                        pool.discard(connection)
+                        connection = None
+                else:
+                    self.sent(message)
+        finally:
+            if connection is not None:
+                pool.release(connection)
+
+    def build(self, message: OutboxMessage) -> EmailMultiAlternatives:
+        email = EmailMultiAlternatives(
+            subject=message.subject,
+            body=message.body,
+            from_email=message.from_email,
+            to=message.recipients,
+        )
+
+        if message.html_body is not None:
+            email.attach_alternative(message.html_body, 'text/html')
+
+        return email
+
+    def sent(self, message: OutboxMessage):
+        message.attempts += 1
+        message.status = OutboxStatus.SENT
+        message.sent_at = timezone.now()
+        message.last_error = None
+        metrics.increment('outbox.sent')
+
+    def failed(self, message: OutboxMessage, error: Exception):
+        message.attempts += 1
+        message.last_error = f'{type(error).__name__}: {error}'
+
+        if message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            message.status = OutboxStatus.DEAD
+            metrics.increment('outbox.dead')
+            self.stderr.write(f'Mail {message.id} dead-lettered after {message.attempts} attempts: {message.last_error}')
+            return
+
+        backoff = min(
+            settings.OUTBOX_RETRY_BACKOFF_SECONDS * 2 ** (message.attempts - 1),
+            settings.OUTBOX_MAX_BACKOFF_SECONDS
+        )
+        message.next_attempt_at = timezone.now() + timedelta(seconds=backoff)
+        metrics.increment('outbox.retried')
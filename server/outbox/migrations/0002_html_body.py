@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('outbox', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='html_body',
+            field=models.TextField(null=True),
+        ),
+    ]
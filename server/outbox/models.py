@@ -0,0 +1,35 @@
+from django.db.models import Model, AutoField, CharField, TextField, JSONField, SmallIntegerField, DateTimeField, Index
+from django.utils import timezone
+from enum import StrEnum
+
+
+class OutboxStatus(StrEnum):
+    PENDING = 'PENDING'
+    SENT = 'SENT'
+    # Gave up after OUTBOX_MAX_ATTEMPTS
+    DEAD = 'DEAD'
+
+
+class OutboxMessage(Model):
+    id = AutoField(primary_key=True)
+    subject = CharField(max_length=255, null=False)
+    body = TextField(null=False)
+    html_body = TextField(null=True)
+    from_email = CharField(max_length=254, null=False)
+    recipients = JSONField(null=False)
+
+    status = CharField(max_length=10, default=OutboxStatus.PENDING.value, null=False)
+    attempts = SmallIntegerField(default=0, null=False)
+    next_attempt_at = DateTimeField(default=timezone.now, null=False)
+    last_error = TextField(null=True)
+
+    created_at = DateTimeField(auto_now_add=True)
+    sent_at = DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.id)
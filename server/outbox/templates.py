@@ -0,0 +1,92 @@
+"""
+Registry of the transactional mail templates stored in outbox/mail_templates.
+Each template is read, dedented and filled with the values coming from the
+environment once, so rendering a mail is a single string substitution.
+"""
+from django.conf import settings
+from string import Template
+from threading import Lock
+from typing import NamedTuple, Optional
+import html
+import os
+import textwrap
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), 'mail_templates')
+
+
+class RenderedMail(NamedTuple):
+    text: str
+    html: Optional[str]
+
+
+class MailTemplate:
+    def __init__(self, text: str, html_text: Optional[str], static_context: dict):
+        self.text = self.compile(text, static_context)
+        self.html = None
+
+        if html_text is not None:
+            self.html = self.compile(html_text, escape(static_context))
+
+    def compile(self, source: str, static_context: dict) -> Template:
+        # Literal '$$' must survive the first substitution to still be an escape in the second one
+        source = textwrap.dedent(source).replace('$$', '$$$$')
+        static_context = {key: str(value).replace('$', '$$') for key, value in static_context.items()}
+
+        return Template(Template(source).safe_substitute(static_context))
+
+    def render(self, **context) -> RenderedMail:
+        return RenderedMail(
+            text=self.text.substitute(context),
+            html=self.html.substitute(escape(context)) if self.html is not None else None
+        )
+
+
+def escape(context: dict) -> dict:
+    return {key: html.escape(str(value)) for key, value in context.items()}
+
+
+def get_static_context() -> dict:
+    """ Values that are the same for every mail """
+    return {
+        'support_email': settings.EMAIL_HOST_USER,
+        'otp_valid_hours': settings.OTP_VALIDATION_SECONDS // 3600,
+        'reset_valid_hours': settings.FORGOT_PASS_VALIDATION_SECONDS // 3600,
+    }
+
+
+_lock = Lock()
+_templates = None
+
+
+def load_templates() -> dict[str, MailTemplate]:
+    global _templates
+
+    with _lock:
+        if _templates is None:
+            static_context = get_static_context()
+            templates = {}
+
+            for filename in sorted(os.listdir(TEMPLATES_DIR)):
+                name, extension = os.path.splitext(filename)
+
+                if extension != '.txt':
+                    continue
+
+                templates[name] = MailTemplate(
+                    read(filename),
+                    read(name + '.html') if os.path.exists(os.path.join(TEMPLATES_DIR, name + '.html')) else None,
+                    static_context
+                )
+
+            _templates = templates
+
+    return _templates
+
+
+def read(filename: str) -> str:
+    with open(os.path.join(TEMPLATES_DIR, filename), encoding='utf-8') as file:
+        return file.read()
+
+
+def render(name: str, **context) -> RenderedMail:
+    return load_templates()[name].render(**context)
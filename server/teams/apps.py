@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class ContestsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'teams'
+
+    def ready(self):
+        # Connects the membership graph signals, registers the cached representations
+        from . import graph, serializers  # noqa: F401
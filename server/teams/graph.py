@@ -0,0 +1,208 @@
+"""
+In-process graph of team memberships and pending invites, answering the invite search
+without the database.
+
+The graph is first built in a background thread when the process serves its first request,
+lookups made before it is done wait for it. Updates are applied from the model signals once
+their transaction commits. The graph is rebuilt from the database every TEAM_GRAPH_REFRESH_SECONDS,
+picking up the changes made by other processes, so reads are only used where a
+slightly stale answer is harmless: inviting always checks the database. Contest
+registrations are not kept here, their lookups are answered by the database (teams.helpers).
+"""
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from invites.models import Invite
+from threading import Lock, Thread
+from common import metrics
+from .models import TeamMember
+import time
+
+ADD = 'add'
+REMOVE = 'remove'
+
+
+class Relation:
+    """ key -> user id -> ids of the rows linking them, duplicate rows are removed one at a time """
+
+    def __init__(self):
+        self._links = {}
+
+    def add(self, key, user_id: int, row_id: int):
+        self._links.setdefault(key, {}).setdefault(user_id, set()).add(row_id)
+
+    def remove(self, key, user_id: int, row_id: int):
+        users = self._links.get(key)
+        rows = users.get(user_id) if users is not None else None
+
+        if rows is None:
+            return
+
+        rows.discard(row_id)
+
+        if not rows:
+            del users[user_id]
+
+            if not users:
+                del self._links[key]
+
+    def users(self, key) -> set:
+        return set(self._links.get(key, ()))
+
+    def __len__(self) -> int:
+        return sum(len(users) for users in self._links.values())
+
+
+class GraphState:
+    def __init__(self):
+        self.members = Relation()  # team id -> users
+        self.invites = Relation()  # team id -> invited users
+
+    def apply(self, action: str, row: tuple):
+        """ Applies a saved or deleted row, see describe() """
+        model, row_id, team_id, user_id = row
+        relation = self.members if model is TeamMember else self.invites
+        getattr(relation, action)(team_id, user_id, row_id)
+
+
+class TeamGraph:
+    def __init__(self):
+        self._state = None
+        self._loaded_at = None
+        self._lock = Lock()
+        # Updates received while a rebuild reads the database, replayed onto its result
+        self._log = None
+        self._rebuilding = False
+        self._build_lock = Lock()
+
+    def invite_excluded(self, team_id: str) -> set:
+        """ Members and invited users of the team """
+        state = self.get()
+
+        with self._lock:
+            return state.members.users(team_id) | state.invites.users(team_id)
+
+    def update(self, action: str, row: tuple):
+        with self._lock:
+            if self._state is not None:
+                self._state.apply(action, row)
+
+            if self._log is not None:
+                self._log.append((action, row))
+
+    def get(self) -> GraphState:
+        if self._state is None:
+            self.rebuild()
+        elif time.monotonic() - self._loaded_at >= settings.TEAM_GRAPH_REFRESH_SECONDS:
+            self.rebuild_in_background()
+
+        return self._state
+
+    def warm(self):
+        """ Starts the first build without waiting for a lookup to need it """
+        if self._state is None:
+            self.rebuild_in_background()
+
+    def rebuild_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+
+            self._rebuilding = True
+
+        Thread(target=self._rebuild_thread, name='team-graph-rebuild', daemon=True).start()
+
+    def _rebuild_thread(self):
+        try:
+            self.rebuild(refresh=True)
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+            # Connections are per thread, do not leave this one open
+            connections.close_all()
+
+    def rebuild(self, refresh: bool = False):
+        with self._build_lock:
+            # Requests arriving together before the first build wait for a single one
+            if self._state is not None and not refresh:
+                return
+
+            with self._lock:
+                self._log = []
+
+            try:
+                with metrics.timer('team_graph.rebuild'):
+                    state = self.load()
+            except Exception:
+                with self._lock:
+                    self._log = None
+                raise
+
+            with self._lock:
+                for action, row in self._log:
+                    state.apply(action, row)
+
+                self._state, self._log = state, None
+                self._loaded_at = time.monotonic()
+
+        metrics.set_gauge('team_graph.memberships', len(state.members))
+
+    def load(self) -> GraphState:
+        state = GraphState()
+
+        for row_id, team_id, user_id in TeamMember.objects.values_list('id', 'team', 'user').iterator(chunk_size=5000):
+            state.members.add(team_id, user_id, row_id)
+
+        for row_id, team_id, user_id in Invite.objects.values_list('id', 'team', 'user').iterator(chunk_size=5000):
+            state.invites.add(team_id, user_id, row_id)
+
+        return state
+
+
+team_graph = TeamGraph()
+
+
+def invite_excluded(team_id: str) -> set:
+    if settings.TEAM_GRAPH:
+        return team_graph.invite_excluded(team_id)
+
+    team_members = TeamMember.objects.filter(team=team_id).values_list('user', flat=True)
+    pending_invites = Invite.objects.filter(team=team_id).values_list('user', flat=True)
+
+    return set(team_members.union(pending_invites))
+
+
+def describe(instance) -> tuple:
+    """ (model, row id, team id, user id) of a row, read before deletion clears its pk """
+    return type(instance), instance.pk, instance.team_id, instance.user_id
+
+
+# Built in the serving process: app loading also runs for management commands, before migrations,
+# and threads started before workers are forked do not run in them
+@receiver(request_started)
+def warm_graph(sender, **kwargs):
+    if settings.TEAM_GRAPH:
+        team_graph.warm()
+
+
+def track(action: str, instance):
+    if settings.TEAM_GRAPH:
+        row = describe(instance)
+        # Rolled back changes never reach the graph
+        transaction.on_commit(lambda: team_graph.update(action, row))
+
+
+@receiver(post_save, sender=TeamMember)
+@receiver(post_save, sender=Invite)
+def graph_row_saved(sender, instance, created, **kwargs):
+    if created:
+        track(ADD, instance)
+
+
+@receiver(post_delete, sender=TeamMember)
+@receiver(post_delete, sender=Invite)
+def graph_row_deleted(sender, instance, **kwargs):
+    track(REMOVE, instance)
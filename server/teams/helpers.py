@@ -1,4 +1,5 @@
 from common.exceptions import BadRequest, NotFound
+from contests.models import TeamContestUserRegistration
 from teams.models import Team
 
 
@@ -12,3 +13,13 @@ def get_team(team_id: str) -> Team:
         raise NotFound(message='Invalid team id')
 
     return team
+
+
+def contest_registered_members(contest_id: int, member_ids) -> list:
+    """ Sorted ids of the given members registered for the contest, through any team """
+    return sorted(set(
+        TeamContestUserRegistration.objects.filter(
+            team_contest_registration__contest=contest_id,
+            user__in=member_ids,
+        ).values_list('user', flat=True)
+    ))
@@ -1,9 +1,9 @@
-from common.serializers import DynamicFieldsModelSerializer
+from common.serializers import CachedRepresentationMixin, DynamicFieldsModelSerializer
 from .models import Team, TeamMember
 from users.serializers import UserSerializer
 
 
-class TeamSerializer(DynamicFieldsModelSerializer):
+class TeamSerializer(CachedRepresentationMixin, DynamicFieldsModelSerializer):
     leader = UserSerializer()
 
     class Meta:
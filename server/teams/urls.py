@@ -5,6 +5,7 @@ urlpatterns = [
     path('', CreateTeam.as_view()),
     path('/<slug:team_id>', GetTeam.as_view()),
     path('/<slug:team_id>/members', GetTeamMembers.as_view()),
+    path('/<slug:team_id>/overview', GetTeamOverview.as_view()),
     path(
         '/<slug:team_id>/members/<int:contest_id>',
         GetContestRegisteredTeamMembers.as_view()
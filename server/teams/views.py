@@ -1,22 +1,25 @@
-from django.db.models import Q
 from django.contrib.auth.models import User
+from django.db.models import Prefetch, prefetch_related_objects
 from django.utils.decorators import method_decorator
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from django.db import transaction, IntegrityError
-from .helpers import get_team
+from .graph import invite_excluded
+from .helpers import contest_registered_members, get_team
 from .models import Team, TeamMember
 from .serializers import TeamSerializer
+from common.compiled import CompiledSerializer
 from common.decorators import login_required, body
-from common.exceptions import BadRequest, Conflict, InternalServerError
+from common.exceptions import BadRequest, Conflict, InternalServerError, NotFound
+from common.ids import TEAM_IDS
+from users.search import parse_limit, search_users
 from users.serializers import UserSerializer
 from invites.helpers import verify_team_leader
 from invites.models import Invite
 from invites.serializers import InviteSerializer
 from contests.helpers import get_contest
+from contests.models import TeamContestRegistration, TeamContestUserRegistration
 from contests.serializers import ContestSerializer, TeamContestRegistrationSerializer, TeamContestUserRegistrationSerializer
-import secrets
-import string
 
 
 @method_decorator(login_required, name="dispatch")
@@ -24,6 +27,7 @@ class CreateTeam(APIView):
     @body({'team_name'})
     def post(self, request):
         team_name = request.data['team_name']
+        team_id = generate_uid()
 
         try:
             with transaction.atomic():
@@ -34,11 +38,6 @@ class CreateTeam(APIView):
                 if Team.objects.filter(team_name__iexact=team_name).exists():
                     raise Conflict(message='This team name is already taken.')
 
-                team_id = generate_uid()
-
-                while Team.objects.filter(team_id=team_id).exists():
-                    team_id = generate_uid()
-
                 new_team = Team(
                     team_id=team_id,
                     team_name=team_name,
@@ -64,13 +63,16 @@ class GetTeam(APIView):
         return Response(data=serializer.data)
 
 
+TEAM_MEMBERS = CompiledSerializer(lambda: UserSerializer())
+
+
 class GetTeamMembers(APIView):
     def get(self, _, team_id):
         user_ids = TeamMember.objects.filter(
             team_id=team_id).values_list('user')
         users = User.objects.filter(id__in=user_ids)
 
-        serializer = UserSerializer(users, many=True)
+        serializer = TEAM_MEMBERS(users)
 
         return Response(data=serializer.data)
 
@@ -81,16 +83,8 @@ class GetContestRegisteredTeamMembers(APIView):
         team = get_team(team_id)
         contest = get_contest(contest_id)
 
-        team_members = team.team_members.values_list(
-            'user__id',
-            flat=True
-        )
-        registered_users_in_contest = contest.registered_teams.filter(
-            registered_members__user__id__in=team_members
-        ).values_list(
-            'registered_members__user__id',
-            flat=True
-        ).all()
+        registered_users_in_contest = contest_registered_members(
+            contest.id, team.team_members.values_list('user', flat=True))
 
         return Response(data=registered_users_in_contest)
 
@@ -99,23 +93,15 @@ class GetContestRegisteredTeamMembers(APIView):
 class GetUninvitedUsers(APIView):
     def get(self, request, team_id):
         username = request.GET.get('username', None)
-        limit = request.GET.get('limit', 10)
+        limit = parse_limit(request.GET.get('limit'))
 
         if username is None:
             return Response(data=[])
 
-        team_members = TeamMember.objects.filter(
-            team=team_id).values_list('user', flat=True)
-
-        pending_invites = Invite.objects.filter(
-            Q(team=team_id)).values_list('user', flat=True)
+        excluded = invite_excluded(team_id)
+        excluded.add(request.user.id)
 
-        users = User.objects.filter(
-            Q(username__icontains=username)
-            & ~Q(id=request.user.id)
-            & ~Q(id__in=team_members)
-            & ~Q(id__in=pending_invites)
-        ).all()[0:limit]
+        users = search_users(username, limit, exclude=excluded)
 
         data = []
         for user in users:
@@ -185,7 +171,75 @@ class GetPendingInvites(APIView):
         return Response(data=serializer.data)
 
 
-def generate_uid(length=8):
-    uid = ''.join(secrets.choice(string.ascii_lowercase + string.digits)
-                  for i in range(length))
-    return 'T-' + uid
+@method_decorator(login_required, name="dispatch")
+class GetTeamOverview(APIView):
+    """
+    The team page in one response: the team, its members and contest registrations, the members
+    registered for ?contest_id= and, for the leader only, the pending invites.
+    One query per relation whatever the number of rows.
+    """
+
+    def get(self, request, team_id):
+        contest_id = request.GET.get('contest_id', None)
+
+        if contest_id is not None:
+            try:
+                contest_id = int(contest_id)
+            except ValueError:
+                raise BadRequest(message='contest_id must be an integer.')
+
+        team = Team.objects.select_related('leader__profile').filter(team_id=team_id).first()
+
+        if team is None:
+            raise NotFound(message='Invalid team id')
+
+        contest = get_contest(contest_id) if contest_id is not None else None
+        is_leader = request.user.id == team.leader_id
+
+        prefetches = [
+            Prefetch('team_members', queryset=TeamMember.objects.select_related('user__profile')),
+            Prefetch('registered_team_contests', queryset=TeamContestRegistration.objects.select_related(
+                'contest').prefetch_related(Prefetch(
+                    'registered_members',
+                    queryset=TeamContestUserRegistration.objects.select_related('user__profile')
+                ))),
+        ]
+
+        if is_leader:
+            prefetches.append(Prefetch('pending_invites', queryset=Invite.objects.select_related('user__profile')))
+
+        prefetch_related_objects([team], *prefetches)
+
+        data = {
+            'team': TeamSerializer(team).data,
+            'members': UserSerializer(
+                [membership.user for membership in team.team_members.all()],
+                many=True
+            ).data,
+            'registered_contests': TeamContestRegistrationSerializer(
+                team.registered_team_contests.all(),
+                read_only=True,
+                many=True,
+                fields={
+                    'contest': ContestSerializer(),
+                    'registered_members': TeamContestUserRegistrationSerializer(many=True)
+                }
+            ).data,
+        }
+
+        if contest is not None:
+            data['contest_registered_members'] = contest_registered_members(
+                contest.id, [membership.user_id for membership in team.team_members.all()])
+
+        if is_leader:
+            data['pending_invites'] = InviteSerializer(
+                team.pending_invites.all(),
+                many=True,
+                fields={'user': UserSerializer()}
+            ).data
+
+        return Response(data=data)
+
+
+def generate_uid():
+    return TEAM_IDS.allocate()
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class ContestsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        # Connects the snapshot invalidation and search index signals, registers the cached representations
+        from . import search, serializers, snapshot  # noqa: F401
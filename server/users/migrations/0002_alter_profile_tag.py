@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='tag',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+    ]
@@ -10,7 +10,7 @@ from django.db.models import Model, CharField, SmallIntegerField, OneToOneField,
 class Profile(Model):
     user = OneToOneField(User, on_delete=CASCADE)
 
-    tag = CharField(max_length=50, null=False)
+    tag = CharField(max_length=50, unique=True, null=False)
     avatar_idx = SmallIntegerField()
     institution = CharField(max_length=100, null=False)
 
@@ -0,0 +1,178 @@
+"""
+Username search for /api/users and the team invite box.
+
+Prefix matches come from an in-process sorted index of lowercased usernames
+(USER_SEARCH_INDEX), kept in sync by the User signals and rebuilt every
+USER_SEARCH_REFRESH_SECONDS to pick up changes made by other processes. The
+remaining slots are filled with infix matches from the database, served on
+PostgreSQL by the trigram index created in users/migrations/0003_username_trigram_index.
+
+Results are ranked: prefix matches first, shortest usernames first, then infix matches.
+"""
+from bisect import bisect_left, insort
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.functions import Length
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from threading import Lock
+from common import metrics
+from common.exceptions import BadRequest
+import time
+
+# Prefix matches looked at per requested result, the shortest of them are returned
+CANDIDATES_PER_RESULT = 5
+
+
+def parse_limit(value) -> int:
+    if value is None:
+        return settings.USER_SEARCH_DEFAULT_LIMIT
+
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise BadRequest(message='limit must be an integer.')
+
+    return max(1, min(limit, settings.USER_SEARCH_MAX_LIMIT))
+
+
+class UsernameIndex:
+    """ Sorted (lowercased username, user id) pairs, prefixes are found by bisection """
+
+    def __init__(self):
+        self._entries = []
+        self._keys = {}  # user id -> lowercased username
+        self._loaded_at = None
+        self._lock = Lock()
+        self._build_lock = Lock()
+
+    def prefix(self, query: str, limit: int, exclude: set) -> list[int]:
+        self.refresh_if_stale()
+        candidates = []
+
+        with self._lock:
+            idx = bisect_left(self._entries, (query,))
+
+            while idx < len(self._entries) and len(candidates) < limit * CANDIDATES_PER_RESULT:
+                key, user_id = self._entries[idx]
+
+                if not key.startswith(query):
+                    break
+
+                if user_id not in exclude:
+                    candidates.append((len(key), key, user_id))
+
+                idx += 1
+
+        candidates.sort()
+        return [user_id for _, _, user_id in candidates[:limit]]
+
+    def put(self, user_id: int, username: str):
+        with self._lock:
+            if self._loaded_at is None:
+                # Nothing to update before the first build, which reads it from the database anyway
+                return
+
+            self._remove(user_id)
+            key = username.lower()
+            insort(self._entries, (key, user_id))
+            self._keys[user_id] = key
+
+    def remove(self, user_id: int):
+        with self._lock:
+            self._remove(user_id)
+
+    def _remove(self, user_id: int):
+        key = self._keys.pop(user_id, None)
+
+        if key is None:
+            return
+
+        idx = bisect_left(self._entries, (key, user_id))
+
+        if idx < len(self._entries) and self._entries[idx] == (key, user_id):
+            del self._entries[idx]
+
+    def refresh_if_stale(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < settings.USER_SEARCH_REFRESH_SECONDS:
+            return
+
+        with self._build_lock:
+            # Another thread may have rebuilt it while this one was waiting
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < settings.USER_SEARCH_REFRESH_SECONDS:
+                return
+
+            # Built outside of the search lock, searches keep using the previous index meanwhile
+            with metrics.timer('user_search.index_build'):
+                keys = {
+                    user_id: username.lower()
+                    for user_id, username in User.objects.values_list('id', 'username').iterator(chunk_size=2000)
+                }
+                entries = sorted((key, user_id) for user_id, key in keys.items())
+
+            with self._lock:
+                self._entries, self._keys = entries, keys
+                self._loaded_at = time.monotonic()
+
+        metrics.set_gauge('user_search.index_size', len(entries))
+
+
+username_index = UsernameIndex()
+
+
+def prefix_matches(query: str, limit: int, exclude: set) -> list[int]:
+    if settings.USER_SEARCH_INDEX:
+        return username_index.prefix(query, limit, exclude)
+
+    return list(
+        User.objects
+        .filter(username__istartswith=query)
+        .exclude(id__in=exclude)
+        .order_by(Length('username'), 'username')
+        .values_list('id', flat=True)[:limit]
+    )
+
+
+def search_users(query: str, limit: int, exclude=()) -> list[User]:
+    """ Users with a profile whose username contains the query, ranked, with their profile loaded """
+    query = query.strip().lower()
+
+    if not query:
+        return []
+
+    exclude = set(exclude)
+    users = User.objects.select_related('profile').filter(profile__isnull=False)
+
+    ids = prefix_matches(query, limit, exclude)
+    found = users.in_bulk(ids)
+    # The index of this process may lag behind renames made by others
+    results = [
+        found[user_id] for user_id in ids
+        if user_id in found and found[user_id].username.lower().startswith(query)
+    ]
+
+    metrics.increment('user_search.prefix_results', len(results))
+
+    if len(results) < limit:
+        results += (
+            users
+            .filter(username__icontains=query)
+            .exclude(id__in=exclude.union(user.id for user in results))
+            .order_by(Length('username'), 'username')[:limit - len(results)]
+        )
+
+    return results
+
+
+# No sender filter: saves through proxy models (users_auth.models.TokenUser) are sent with the proxy as sender
+@receiver(post_save)
+def index_username(sender, instance, **kwargs):
+    # Users rebuilt from a token or a snapshot may not have loaded their username
+    if settings.USER_SEARCH_INDEX and isinstance(instance, User) and 'username' in instance.__dict__:
+        username_index.put(instance.pk, instance.username)
+
+
+@receiver(post_delete)
+def unindex_username(sender, instance, **kwargs):
+    if settings.USER_SEARCH_INDEX and isinstance(instance, User):
+        username_index.remove(instance.pk)
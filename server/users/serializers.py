@@ -1,6 +1,5 @@
 from django.contrib.auth.models import User
-from rest_framework.serializers import ModelSerializer
-from common.serializers import DynamicFieldsModelSerializer
+from common.serializers import CachedRepresentationMixin, DynamicFieldsModelSerializer, FlattenedModelSerializer
 from .models import Profile
 
 
@@ -10,8 +9,10 @@ class ProfileSerializer(DynamicFieldsModelSerializer):
         fields = ['tag', 'phone_no', 'institution', 'avatar_idx']
 
 
-class AuthUserSerializer(ModelSerializer):
+class AuthUserSerializer(CachedRepresentationMixin, FlattenedModelSerializer):
     profile = ProfileSerializer()
+    # Move all fields from profile to user representation.
+    flatten = {'profile': None}
 
     class Meta:
         model = User
@@ -19,27 +20,12 @@ class AuthUserSerializer(ModelSerializer):
             'id', 'email', 'username', 'first_name', 'last_name', 'profile'
         ]
 
-    def to_representation(self, obj):
-        # Move all fields from profile to user representation.
-        representation = super().to_representation(obj)
-        profile_representation = representation.pop('profile')
 
-        for key in profile_representation:
-            representation[key] = profile_representation[key]
-
-        return representation
-
-
-class UserSerializer(ModelSerializer):
+class UserSerializer(CachedRepresentationMixin, FlattenedModelSerializer):
     profile = ProfileSerializer()
+    # Move 'avatar_idx' from profile to user representation.
+    flatten = {'profile': ['avatar_idx']}
 
     class Meta:
         model = User
         fields = ['id', 'username', 'first_name', 'last_name', 'profile']
-
-    def to_representation(self, obj):
-        # Move 'avatar_idx' from profile to user representation.
-        representation = super().to_representation(obj)
-        profile_representation = representation.pop('profile')
-        representation['avatar_idx'] = profile_representation['avatar_idx']
-        return representation
@@ -0,0 +1,116 @@
+"""
+Cached snapshot of the logged in user and their profile, used instead of loading both
+rows on every request. Snapshots are dropped whenever a User or Profile row is saved or
+deleted, and expire after AUTH_SNAPSHOT_TTL seconds in any case. Only enabled with a
+shared CACHE_URL (AUTH_SNAPSHOT), so that invalidations reach every process.
+
+Nothing derived from the password is cached: its hash is read from the database on every
+request and the session is verified against it, so changing or resetting a password logs
+the other sessions out right away.
+"""
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
+from django.db import router
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.crypto import constant_time_compare
+from typing import Optional
+from common import metrics
+from .models import Profile
+
+CACHE_KEY_PREFIX = 'users.snapshot.'
+
+# Only ModelBackend sessions are served from snapshots
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+ALL_USER_FIELDS = [field.attname for field in User._meta.concrete_fields]
+USER_FIELDS = [name for name in ALL_USER_FIELDS if name != 'password']
+PROFILE_FIELDS = [field.attname for field in Profile._meta.concrete_fields]
+
+
+def get_cache():
+    return caches[settings.AUTH_SNAPSHOT_CACHE_ALIAS]
+
+
+def cache_key(user_id) -> str:
+    return f'{CACHE_KEY_PREFIX}{user_id}'
+
+
+def get_user(request):
+    """ Same as django.contrib.auth.get_user(), served from the snapshot when possible """
+    try:
+        user_id = User._meta.pk.to_python(request.session[SESSION_KEY])
+        backend_path = request.session[BACKEND_SESSION_KEY]
+    except Exception:
+        return AnonymousUser()
+
+    if backend_path != MODEL_BACKEND:
+        return auth.get_user(request)
+
+    snapshot = get_cache().get(cache_key(user_id))
+    session_hash = request.session.get(HASH_SESSION_KEY)
+
+    if snapshot is not None and session_hash:
+        password = User.objects.filter(pk=user_id).values_list('password', flat=True).first()
+
+        if password is not None:
+            user = build_user(snapshot, password)
+
+            if constant_time_compare(session_hash, user.get_session_auth_hash()):
+                metrics.increment('auth_snapshot.hit')
+                return user
+
+    # Also flushes sessions whose password changed
+    metrics.increment('auth_snapshot.miss')
+    user = auth.get_user(request)
+
+    if user.is_authenticated:
+        store(user)
+
+    return user
+
+
+def store(user: User):
+    profile = Profile.objects.filter(user=user).first()
+
+    # Accounts created outside of the registration flow may not have one
+    if profile is None:
+        return
+
+    User._meta.get_field('profile').set_cached_value(user, profile)
+
+    snapshot = {
+        'user': [getattr(user, name) for name in USER_FIELDS],
+        'profile': [getattr(profile, name) for name in PROFILE_FIELDS],
+    }
+    get_cache().set(cache_key(user.pk), snapshot, settings.AUTH_SNAPSHOT_TTL)
+
+
+def build_user(snapshot: dict, password: str) -> User:
+    # Saving an instance built with from_db() only writes its fields when its database is known
+    values = dict(zip(USER_FIELDS, snapshot['user']), password=password)
+    user = User.from_db(router.db_for_read(User), ALL_USER_FIELDS, [values[name] for name in ALL_USER_FIELDS])
+    profile = Profile.from_db(router.db_for_read(Profile), PROFILE_FIELDS, snapshot['profile'])
+
+    User._meta.get_field('profile').set_cached_value(user, profile)
+    Profile._meta.get_field('user').set_cached_value(profile, user)
+
+    return user
+
+
+def invalidate(user_id: Optional[int]):
+    if user_id is not None:
+        get_cache().delete(cache_key(user_id))
+
+
+# No sender filter: saves through proxy models (users_auth.models.TokenUser) are sent with the proxy as sender
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_snapshot(sender, instance, **kwargs):
+    if isinstance(instance, User):
+        invalidate(instance.pk)
+    elif isinstance(instance, Profile):
+        invalidate(instance.user_id)
@@ -4,6 +4,7 @@ from .views import *
 urlpatterns = [
     path('', Users.as_view()),
     path('/me', AuthUser.as_view()),
+    path('/me/dashboard', AuthUserDashboard.as_view()),
     path('/me/created-team', AuthUserCreatedTeam.as_view()),
     path('/me/joined-teams', AuthUserJoinedTeams.as_view()),
     path('/me/received-team-invites', AuthUserReceivedTeamInvites.as_view()),
@@ -1,30 +1,37 @@
-from django.db.models import Q
-from django.contrib.auth.models import User
+from django.db.models import Prefetch, Q, prefetch_related_objects
 from django.utils.decorators import method_decorator
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.serializers import CharField
+from .search import parse_limit, search_users
 from .serializers import UserSerializer
 from common.decorators import login_required
+from invites.models import Invite
 from invites.serializers import InviteSerializer
+from teams.models import Team, TeamMember
 from teams.serializers import TeamSerializer, TeamMemberSerializer
+from contests.models import SoloContestRegistration, TeamContestUserRegistration
 from contests.serializers import ContestSerializer, SoloContestRegistrationSerializer, TeamContestRegistrationSerializer, TeamContestUserRegistrationSerializer
 
 
+def get_auth_user_data(user) -> dict:
+    return {
+        'id': user.id,
+        'tag': user.profile.tag,
+        'avatar_idx': user.profile.avatar_idx,
+        'institution': user.profile.institution,
+        'phone_no': user.profile.phone_no,
+        'email': user.email,
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+    }
+
+
 @method_decorator(login_required, name="dispatch")
 class AuthUser(APIView):
     def get(self, request):
-        return Response(data={
-            'id': request.user.id,
-            'tag': request.user.profile.tag,
-            'avatar_idx': request.user.profile.avatar_idx,
-            'institution': request.user.profile.institution,
-            'phone_no': request.user.profile.phone_no,
-            'email': request.user.email,
-            'username': request.user.username,
-            'first_name': request.user.first_name,
-            'last_name': request.user.last_name,
-        })
+        return Response(data=get_auth_user_data(request.user))
 
     def patch(self, request):
         user = request.user
@@ -57,15 +64,12 @@ class AuthUser(APIView):
 class Users(APIView):
     def get(self, request):
         username = request.GET.get('username', None)
-        limit = request.GET.get('limit', 10)
+        limit = parse_limit(request.GET.get('limit'))
 
         if username is None:
             return Response({'data': []}, status=200)
 
-        users = User.objects.filter(
-            Q(username__icontains=username)
-            & ~Q(user_id=request.user.user_id)
-        ).all()[0:limit]
+        users = search_users(username, limit, exclude={request.user.id})
 
         serializer = UserSerializer(users, many=True)
         return Response(data=serializer.data)
@@ -185,3 +189,74 @@ class AuthUserTeamContests(APIView):
             }
         )
         return Response(data=serializer.data)
+
+
+@method_decorator(login_required, name="dispatch")
+class AuthUserDashboard(APIView):
+    """
+    Everything the /me endpoints above return, in one response.
+    One query per relation whatever the number of rows, the nested objects are loaded with them.
+    """
+
+    def get(self, request):
+        user = request.user
+
+        prefetch_related_objects(
+            [user],
+            Prefetch('created_team', queryset=Team.objects.select_related('leader__profile')),
+            Prefetch('user_memberships', queryset=TeamMember.objects.select_related('team__leader__profile')),
+            Prefetch('received_invites', queryset=Invite.objects.select_related('team').only(
+                'id', 'user', 'team__team_id', 'team__team_name')),
+            Prefetch('registered_solo_contests', queryset=SoloContestRegistration.objects.select_related('contest')),
+            Prefetch('team_contest_registrations', queryset=TeamContestUserRegistration.objects.select_related(
+                'team_contest_registration__contest', 'team_contest_registration__team')),
+        )
+
+        created_team = next(iter(user.created_team.all()), None)
+        joined_teams = [
+            membership for membership in user.user_memberships.all()
+            if created_team is None or membership.team_id != created_team.team_id
+        ]
+
+        return Response(data={
+            'user': get_auth_user_data(user),
+            'created_team': TeamSerializer(created_team).data if created_team else None,
+            'joined_teams': TeamMemberSerializer(
+                joined_teams,
+                many=True,
+                read_only=True,
+                fields={'team': TeamSerializer()}
+            ).data,
+            'received_team_invites': InviteSerializer(
+                user.received_invites.all(),
+                many=True,
+                read_only=True,
+                fields={'team': TeamSerializer(
+                    empty=True,
+                    fields={'team_id': CharField(), 'team_name': CharField()}
+                )}
+            ).data,
+            'registered_solo_contests': SoloContestRegistrationSerializer(
+                user.registered_solo_contests.all(),
+                read_only=True,
+                many=True,
+                fields={'contest': ContestSerializer(read_only=True)}
+            ).data,
+            'registered_team_contests': TeamContestUserRegistrationSerializer(
+                user.team_contest_registrations.all(),
+                read_only=True,
+                empty=True,
+                many=True,
+                fields={
+                    'team_contest_registration': TeamContestRegistrationSerializer(
+                        fields={
+                            'contest': ContestSerializer(),
+                            'team': TeamSerializer(
+                                empty=True,
+                                fields={'team_id': CharField(), 'team_name': CharField()}
+                            )
+                        }
+                    )
+                }
+            ).data,
+        })
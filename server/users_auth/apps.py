@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class LoginConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users_auth'
+
+    def ready(self):
+        # Connects the signals keeping the availability Bloom filter up to date
+        from . import availability  # noqa: F401
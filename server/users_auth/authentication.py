@@ -0,0 +1,63 @@
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from typing import Optional
+from .models import TokenUser
+from .tokens import ACCESS, decode, tokens_enabled
+
+AUTH_HEADER_PREFIX = 'Bearer '
+
+
+def get_bearer_token(request) -> Optional[str]:
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+
+    if not header.startswith(AUTH_HEADER_PREFIX):
+        return None
+
+    return header[len(AUTH_HEADER_PREFIX):].strip() or None
+
+
+def get_token_claims(request) -> Optional[dict]:
+    """
+    Claims of the access token sent with the Django request, None without a valid one.
+    Cached on the request so login_required and DRF only verify the token once.
+    """
+    if not tokens_enabled():
+        return None
+
+    if not hasattr(request, '_token_claims'):
+        token = get_bearer_token(request)
+        request._token_claims = decode(token, ACCESS) if token is not None else None
+
+    return request._token_claims
+
+
+def get_token_user(request) -> Optional[TokenUser]:
+    claims = get_token_claims(request)
+    return TokenUser.from_claims(claims) if claims is not None else None
+
+
+class JWTAuthentication(BaseAuthentication):
+    """ Bearer access tokens, checked before the session so token requests skip CSRF and the session lookup """
+
+    def authenticate(self, request):
+        django_request = request._request
+
+        if not tokens_enabled() or get_bearer_token(django_request) is None:
+            return None
+
+        claims = get_token_claims(django_request)
+
+        if claims is None:
+            raise AuthenticationFailed('Invalid or expired token.')
+
+        # Reuse the user set by login_required, if any. The type check does not evaluate
+        # the lazy session user, unlike isinstance()
+        user = django_request.__dict__.get('user')
+
+        if type(user) is not TokenUser:
+            user = TokenUser.from_claims(claims)
+
+        return user, claims
+
+    def authenticate_header(self, request):
+        return 'Bearer'
@@ -0,0 +1,203 @@
+"""
+Availability of emails, usernames and phone numbers across verified accounts and
+accounts waiting for verification, answered with a single indexed query.
+
+An optional in-process Bloom filter (AVAILABILITY_BLOOM_FILTER) of every known value
+lets /api/auth/availability answer "free" without the database. It is rebuilt every
+AVAILABILITY_BLOOM_REFRESH_SECONDS and updated on local saves, so values registered by
+other processes since the last rebuild can be reported free: registration itself
+always checks the database.
+"""
+from dataclasses import dataclass, field
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import CharField, F, Value
+from django.db.models.functions import Lower
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from threading import Lock
+from typing import Optional
+from common import metrics
+from users.models import Profile
+from .models import UnverifiedAccount
+import hashlib
+import math
+import time
+
+EMAIL = 'email'
+USERNAME = 'username'
+PHONE_NO = 'phone_no'
+FIELDS = (EMAIL, USERNAME, PHONE_NO)
+
+# Kind of the row of the unverified account registered with the email being checked
+PENDING = 'pending'
+
+
+@dataclass
+class Lookup:
+    taken: set = field(default_factory=set)
+    # Registering again with this email updates that unverified account
+    pending_hash: Optional[str] = None
+
+
+def normalize(name: str, value: Optional[str]) -> Optional[str]:
+    if value is None:
+        return None
+
+    # Emails and usernames are compared case-insensitively, through the LOWER() indexes
+    return value.lower() if name in (EMAIL, USERNAME) else value
+
+
+def tagged(queryset, kind: str, key: Optional[str] = None):
+    # Every part of the union selects the same (kind, key) columns, annotated in the same order
+    return queryset.annotate(
+        kind=Value(kind, output_field=CharField()),
+        key=F(key) if key is not None else Value(None, output_field=CharField()),
+    ).values_list('kind', 'key')
+
+
+def lookup(email: Optional[str] = None, username: Optional[str] = None, phone_no: Optional[str] = None) -> Lookup:
+    """ Which of the given values are taken, in one query """
+    email = normalize(EMAIL, email)
+    username = normalize(USERNAME, username)
+    phone_no = normalize(PHONE_NO, phone_no)
+
+    users = User.objects.alias(email_lower=Lower('email'), username_lower=Lower('username'))
+    unverified = UnverifiedAccount.objects.alias(email_lower=Lower('email'), username_lower=Lower('username'))
+    # Unverified accounts registered with another email hold their username and phone number until they expire
+    others = unverified.active()
+    others = others.exclude(email_lower=email) if email is not None else others
+
+    parts = []
+
+    if email is not None:
+        parts.append(tagged(users.filter(email_lower=email), EMAIL))
+        parts.append(tagged(unverified.filter(email_lower=email), PENDING, key='hash'))
+
+    if username is not None:
+        parts.append(tagged(users.filter(username_lower=username), USERNAME))
+        parts.append(tagged(others.filter(username_lower=username), USERNAME))
+
+    if phone_no is not None:
+        parts.append(tagged(Profile.objects.filter(phone_no=phone_no), PHONE_NO))
+        parts.append(tagged(others.filter(phone_no=phone_no), PHONE_NO))
+
+    result = Lookup()
+
+    if not parts:
+        return result
+
+    metrics.increment('availability.db_lookup')
+
+    for kind, key in parts[0].union(*parts[1:]):
+        if kind == PENDING:
+            result.pending_hash = key
+        else:
+            result.taken.add(kind)
+
+    return result
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(1, capacity)
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item: str):
+        # Double hashing, k positions out of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+class KnownValues:
+    """ Bloom filter of the emails, usernames and phone numbers of every account """
+
+    def __init__(self):
+        self._bloom = None
+        self._loaded_at = None
+        self._lock = Lock()
+
+    def might_be_taken(self, name: str, value: str) -> bool:
+        return self.item(name, value) in self.get()
+
+    def add(self, name: str, value: Optional[str]):
+        # Nothing to update before the first build, which reads it from the database anyway
+        if self._bloom is not None and value:
+            self._bloom.add(self.item(name, value))
+
+    def item(self, name: str, value: str) -> str:
+        return f'{name}:{normalize(name, value)}'
+
+    def get(self) -> BloomFilter:
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < settings.AVAILABILITY_BLOOM_REFRESH_SECONDS:
+            return self._bloom
+
+        with self._lock:
+            # Another thread may have rebuilt it while this one was waiting
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= settings.AVAILABILITY_BLOOM_REFRESH_SECONDS:
+                self._bloom = self.build()
+                self._loaded_at = time.monotonic()
+
+        return self._bloom
+
+    def build(self) -> BloomFilter:
+        bloom = BloomFilter(settings.AVAILABILITY_BLOOM_CAPACITY, settings.AVAILABILITY_BLOOM_ERROR_RATE)
+        sources = (
+            (User.objects.values_list('email', 'username'), (EMAIL, USERNAME)),
+            (Profile.objects.values_list('phone_no'), (PHONE_NO,)),
+            (UnverifiedAccount.objects.values_list('email', 'username', 'phone_no'), FIELDS),
+        )
+        count = 0
+
+        with metrics.timer('availability.bloom_build'):
+            for queryset, names in sources:
+                for row in queryset.iterator(chunk_size=2000):
+                    for name, value in zip(names, row):
+                        if value:
+                            bloom.add(self.item(name, value))
+                            count += 1
+
+        metrics.set_gauge('availability.bloom_items', count)
+        return bloom
+
+
+known_values = KnownValues()
+
+
+def check(values: dict) -> dict:
+    """ {name: available} for the given {name: value}, without the database when the filter never saw any of them """
+    if settings.AVAILABILITY_BLOOM_FILTER and not any(
+            known_values.might_be_taken(name, value) for name, value in values.items()):
+        metrics.increment('availability.bloom_free')
+        return {name: True for name in values}
+
+    # All values are looked up together, the email decides which unverified account is the caller's
+    taken = lookup(**values).taken
+    return {name: name not in taken for name in values}
+
+
+# No sender filter: saves through proxy models (users_auth.models.TokenUser) are sent with the proxy as sender
+@receiver(post_save)
+def add_known_values(sender, instance, **kwargs):
+    if not settings.AVAILABILITY_BLOOM_FILTER:
+        return
+
+    if isinstance(instance, User):
+        known_values.add(EMAIL, instance.__dict__.get('email'))
+        known_values.add(USERNAME, instance.__dict__.get('username'))
+    elif isinstance(instance, Profile):
+        known_values.add(PHONE_NO, instance.__dict__.get('phone_no'))
+    elif isinstance(instance, UnverifiedAccount):
+        for name in FIELDS:
+            known_values.add(name, getattr(instance, name))
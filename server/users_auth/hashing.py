@@ -0,0 +1,152 @@
+"""
+Dedicated, bounded pool for password hashing (PBKDF2 by default).
+Only the pure hashing calls run on the pool, database access stays on the request
+thread. At most PASSWORD_HASHING_WORKERS hashes run at once so hash heavy endpoints
+cannot take all the CPU. Requests are turned away with a 503 when the queue is full
+or when they waited longer than PASSWORD_HASHING_QUEUE_TIMEOUT.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import get_user_model, user_login_failed
+from django.contrib.auth import hashers
+from django.contrib.auth.models import AbstractBaseUser
+from threading import Lock
+from common.exceptions import ServiceUnavailable
+from common import metrics
+import time
+
+BUSY_MESSAGE = 'Server is busy, please try again in a moment.'
+
+# ModelBackend is the only configured backend, login() needs to know it was used
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+_lock = Lock()
+_executor = None
+_pending = 0
+
+
+class QueueTimeout(Exception):
+    pass
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASHING_WORKERS,
+                thread_name_prefix='password-hashing'
+            )
+
+    return _executor
+
+
+def _track(delta: int) -> bool:
+    """ Update the number of queued and running hashes, refusing to go over PASSWORD_HASHING_MAX_QUEUE """
+    global _pending
+
+    with _lock:
+        if delta > 0 and _pending >= settings.PASSWORD_HASHING_MAX_QUEUE:
+            return False
+
+        _pending += delta
+        metrics.set_gauge('hashing.queue_depth', _pending)
+        return True
+
+
+def run(fn, *args):
+    """ Runs fn on the hashing pool and waits for its result, raises ServiceUnavailable when saturated """
+    if not _track(1):
+        metrics.increment('hashing.rejected.saturated')
+        raise ServiceUnavailable(message=BUSY_MESSAGE)
+
+    budget = settings.PASSWORD_HASHING_QUEUE_TIMEOUT
+    submitted_at = time.perf_counter()
+
+    def _run():
+        started_at = time.perf_counter()
+        waited = started_at - submitted_at
+        metrics.observe('hashing.wait_seconds', waited)
+
+        try:
+            # The client has likely given up already, do not burn CPU for it
+            if waited > budget:
+                raise QueueTimeout()
+
+            return fn(*args)
+        finally:
+            metrics.observe('hashing.run_seconds', time.perf_counter() - started_at)
+            _track(-1)
+
+    try:
+        future = get_executor().submit(_run)
+    except RuntimeError:
+        # Interpreter shutting down
+        _track(-1)
+        raise ServiceUnavailable(message=BUSY_MESSAGE)
+
+    try:
+        return future.result()
+    except QueueTimeout:
+        metrics.increment('hashing.rejected.queue_timeout')
+        raise ServiceUnavailable(message=BUSY_MESSAGE)
+
+
+def make_password(password: str) -> str:
+    return run(hashers.make_password, password)
+
+
+def set_password(user: AbstractBaseUser, password: str):
+    """ Same as user.set_password(), with the hash computed on the pool """
+    user.password = make_password(password)
+    # Read by AbstractBaseUser.save() to notify the password validators
+    user._password = password
+
+
+def check_password(user: AbstractBaseUser, password: str) -> bool:
+    """ Same as user.check_password(), with the hashes computed on the pool """
+    encoded = user.password
+
+    if not run(hashers.check_password, password, encoded):
+        return False
+
+    # Upgrade hashes made with an older algorithm or fewer iterations, as Django does
+    preferred = hashers.get_hasher('default')
+
+    try:
+        must_update = hashers.identify_hasher(encoded).algorithm != preferred.algorithm or preferred.must_update(encoded)
+    except ValueError:
+        must_update = False
+
+    if must_update:
+        set_password(user, password)
+        user._password = None
+        user.save(update_fields=['password'])
+
+    return True
+
+
+def authenticate(request, username: str, password: str):
+    """ Counterpart of django.contrib.auth.authenticate() for ModelBackend """
+    UserModel = get_user_model()
+
+    if username is None or password is None:
+        return None
+
+    try:
+        user = UserModel._default_manager.get_by_natural_key(username)
+    except UserModel.DoesNotExist:
+        # Hash anyway so that unknown usernames take as long as wrong passwords
+        make_password(password)
+        user = None
+    else:
+        if not check_password(user, password) or not user.is_active:
+            user = None
+
+    if user is None:
+        user_login_failed.send(sender=__name__, credentials={'username': username}, request=request)
+        return None
+
+    user.backend = MODEL_BACKEND
+    return user
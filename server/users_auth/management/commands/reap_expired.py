@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from common import metrics
+from users_auth.models import ForgotPasswordLink, RevokedToken, UnverifiedAccount
+from datetime import timedelta
+import time
+
+REAPED_MODELS = (UnverifiedAccount, ForgotPasswordLink, RevokedToken)
+
+
+class Command(BaseCommand):
+    help = 'Delete unverified accounts, reset password links and revoked tokens that expired long enough ago'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Delete what has expired and exit instead of polling')
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.REAPER_BATCH_SIZE,
+            help='Rows deleted per transaction')
+        parser.add_argument(
+            '--poll-interval', type=float, default=300.0,
+            help='Seconds to wait once nothing is left to delete')
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = sum(self.reap(model, options['batch_size']) for model in REAPED_MODELS)
+
+            if deleted:
+                self.stdout.write(f'Deleted {deleted} expired rows')
+
+            if options['once']:
+                break
+
+            time.sleep(options['poll_interval'])
+
+    def reap(self, model, batch_size: int) -> int:
+        before = timezone.now() - timedelta(seconds=settings.EXPIRED_ROWS_RETENTION_SECONDS)
+        total = 0
+
+        while True:
+            # Short transactions over a bounded set of primary keys found through the expires_at index,
+            # locks are held for one batch only
+            with transaction.atomic():
+                pks = list(
+                    model.objects.expired(before)
+                    .order_by('expires_at')
+                    .values_list('pk', flat=True)[:batch_size]
+                )
+
+                if not pks:
+                    break
+
+                # Rows renewed since they were selected (registering again) are left alone
+                deleted, _ = model.objects.expired(before).filter(pk__in=pks).delete()
+
+            total += deleted
+            metrics.increment(f'reaper.{model._meta.model_name}', deleted)
+
+            if len(pks) < batch_size:
+                break
+
+        return total
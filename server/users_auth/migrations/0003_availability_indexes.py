@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:31
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users_auth', '0002_tokens'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='unverifiedaccount',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='unverified_email_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='unverifiedaccount',
+            index=models.Index(django.db.models.functions.text.Lower('username'), name='unverified_username_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='unverifiedaccount',
+            index=models.Index(fields=['phone_no'], name='unverified_phone_no_idx'),
+        ),
+        # auth_user belongs to django.contrib.auth, its indexes are created directly
+        migrations.RunSQL(
+            sql='CREATE INDEX auth_user_email_idx ON auth_user (email)',
+            reverse_sql='DROP INDEX auth_user_email_idx',
+        ),
+        migrations.RunSQL(
+            sql='CREATE INDEX auth_user_email_lower_idx ON auth_user (LOWER(email))',
+            reverse_sql='DROP INDEX auth_user_email_lower_idx',
+        ),
+        migrations.RunSQL(
+            sql='CREATE INDEX auth_user_username_lower_idx ON auth_user (LOWER(username))',
+            reverse_sql='DROP INDEX auth_user_username_lower_idx',
+        ),
+    ]
@@ -0,0 +1,46 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import DateTimeField, ExpressionWrapper, F
+
+
+def backfill_expires_at(apps, schema_editor):
+    # Same expiry the views computed from updated_at until now
+    for model_name, seconds in (
+        ('UnverifiedAccount', settings.OTP_VALIDATION_SECONDS),
+        ('ForgotPasswordLink', settings.FORGOT_PASS_VALIDATION_SECONDS),
+    ):
+        model = apps.get_model('users_auth', model_name)
+        model.objects.update(expires_at=ExpressionWrapper(
+            F('updated_at') + timedelta(seconds=seconds), output_field=DateTimeField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users_auth', '0003_availability_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='unverifiedaccount',
+            name='expires_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='forgotpasswordlink',
+            name='expires_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(backfill_expires_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='unverifiedaccount',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='forgotpasswordlink',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -1,5 +1,20 @@
+from datetime import timedelta
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Model, CharField, DateTimeField, EmailField, SmallIntegerField, ForeignKey, CASCADE
+from django.db.models import Model, QuerySet, CharField, DateTimeField, EmailField, SmallIntegerField, ForeignKey, Index, CASCADE
+from django.db.models.functions import Lower
+from django.utils import timezone
+from users.models import Profile
+
+
+class ExpiringQuerySet(QuerySet):
+    """ Rows with an indexed expires_at, deleted by the reap_expired command """
+
+    def active(self):
+        return self.filter(expires_at__gt=timezone.now())
+
+    def expired(self, before=None):
+        return self.filter(expires_at__lte=before or timezone.now())
 
 
 class UnverifiedAccount(Model):
@@ -17,6 +32,23 @@ class UnverifiedAccount(Model):
     username = CharField(max_length=100, null=False)
     password = CharField(max_length=100, null=False)
 
+    # Every save sends a new OTP, valid for OTP_VALIDATION_SECONDS from then on
+    expires_at = DateTimeField(null=False, db_index=True)
+
+    objects = ExpiringQuerySet.as_manager()
+
+    class Meta:
+        # Availability lookups, see users_auth.availability
+        indexes = [
+            Index(Lower('email'), name='unverified_email_lower_idx'),
+            Index(Lower('username'), name='unverified_username_lower_idx'),
+            Index(fields=['phone_no'], name='unverified_phone_no_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.expires_at = timezone.now() + timedelta(seconds=settings.OTP_VALIDATION_SECONDS)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.hash
 
@@ -27,6 +59,77 @@ class ForgotPasswordLink(Model):
                       on_delete=CASCADE, null=False, db_column='user')
     created_at = DateTimeField(auto_now_add=True)
     updated_at = DateTimeField(auto_now=True)
+    expires_at = DateTimeField(null=False, db_index=True)
+
+    objects = ExpiringQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        self.expires_at = timezone.now() + timedelta(seconds=settings.FORGOT_PASS_VALIDATION_SECONDS)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.hash
+
+
+class RevokedToken(Model):
+    """ Revoked token family, see users_auth.tokens """
+    sid = CharField(primary_key=True, null=False, max_length=32)
+    # Once every token of the family has expired the row is useless
+    expires_at = DateTimeField(null=False, db_index=True)
+
+    objects = ExpiringQuerySet.as_manager()
+
+    def __str__(self):
+        return self.sid
+
+
+class LoadDeferredAtOnce:
+    """ Accessing one deferred field loads all of them in a single query """
+
+    def refresh_from_db(self, using=None, fields=None):
+        deferred = self.get_deferred_fields()
+
+        if fields is not None and deferred and set(fields) <= deferred:
+            fields = list(deferred)
+
+        super().refresh_from_db(using, fields)
+
+
+class TokenProfile(LoadDeferredAtOnce, Profile):
+    class Meta:
+        proxy = True
+
+
+class TokenUser(LoadDeferredAtOnce, User):
+    """
+    User rebuilt from the claims of an access token without any query.
+    Fields missing from the token are all loaded at once on first access.
+    """
+
+    class Meta:
+        proxy = True
+
+    @classmethod
+    def from_claims(cls, claims: dict) -> 'TokenUser':
+        user = cls.from_db(None, ['id', 'username'], [claims['uid'], claims['username']])
+        profile = TokenProfile.from_db(
+            None,
+            ['id', 'user_id', 'avatar_idx', 'role'],
+            [claims['pid'], claims['uid'], claims['avatar_idx'], claims['role']]
+        )
+
+        # request.user.profile and profile.user resolve without queries
+        User._meta.get_field('profile').set_cached_value(user, profile)
+        Profile._meta.get_field('user').set_cached_value(profile, user)
+
+        return user
+
+    def refresh_from_db(self, using=None, fields=None):
+        # Reloading drops cached relations, keep the profile built from the token
+        profile_field = User._meta.get_field('profile')
+        profile = profile_field.get_cached_value(self, None)
+
+        super().refresh_from_db(using, fields)
+
+        if profile is not None:
+            profile_field.set_cached_value(self, profile)
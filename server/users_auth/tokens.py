@@ -0,0 +1,142 @@
+"""
+Signed access and refresh tokens, issued at login when AUTH_MODE is 'token' or 'both'.
+Access tokens carry what requests need about the user (id, username, avatar, role)
+so they are verified without touching the database or the session. Both tokens of
+a login share a family id (sid), revoking it invalidates the two of them.
+"""
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.utils.crypto import salted_hmac
+from threading import Lock
+from typing import Optional
+from common import metrics
+from .models import RevokedToken
+import jwt
+import secrets
+import time
+
+SESSION_MODE = 'session'
+TOKEN_MODE = 'token'
+BOTH_MODE = 'both'
+
+ACCESS = 'access'
+REFRESH = 'refresh'
+
+
+def sessions_enabled() -> bool:
+    return settings.AUTH_MODE in (SESSION_MODE, BOTH_MODE)
+
+
+def tokens_enabled() -> bool:
+    return settings.AUTH_MODE in (TOKEN_MODE, BOTH_MODE)
+
+
+class Denylist:
+    """ In-memory copy of the revoked families, reloaded every JWT_DENYLIST_REFRESH_SECONDS """
+
+    def __init__(self):
+        self._revoked = set()
+        self._loaded_at = None
+        self._lock = Lock()
+
+    def is_revoked(self, sid: str) -> bool:
+        self.refresh_if_stale()
+        return sid in self._revoked
+
+    def add(self, sid: str):
+        with self._lock:
+            self._revoked.add(sid)
+
+    def refresh_if_stale(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < settings.JWT_DENYLIST_REFRESH_SECONDS:
+            return
+
+        with self._lock:
+            # Another thread may have reloaded it while this one was waiting
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < settings.JWT_DENYLIST_REFRESH_SECONDS:
+                return
+
+            self._revoked = set(
+                RevokedToken.objects.active().values_list('sid', flat=True))
+            self._loaded_at = time.monotonic()
+
+        metrics.set_gauge('tokens.denylist_size', len(self._revoked))
+
+
+denylist = Denylist()
+
+
+def encode(claims: dict) -> str:
+    return jwt.encode(claims, settings.JWT_SECRET, algorithm=settings.JWT_ALGO)
+
+
+def decode(token: str, token_type: str) -> Optional[dict]:
+    """ Claims of a valid, unrevoked token of the given type, None otherwise """
+    try:
+        claims = jwt.decode(
+            token,
+            settings.JWT_SECRET,
+            algorithms=[settings.JWT_ALGO],
+            options={'require': ['exp', 'iat', 'sid', 'type', 'uid']}
+        )
+    except jwt.InvalidTokenError:
+        metrics.increment('tokens.invalid')
+        return None
+
+    if claims['type'] != token_type:
+        metrics.increment('tokens.invalid')
+        return None
+
+    if denylist.is_revoked(claims['sid']):
+        metrics.increment('tokens.revoked')
+        return None
+
+    return claims
+
+
+def password_fingerprint(user) -> str:
+    """ Changes with the password, so that changing it invalidates the refresh tokens """
+    return salted_hmac('users_auth.tokens.password_fingerprint', user.password).hexdigest()[:16]
+
+
+def issue_tokens(user, profile) -> dict:
+    sid = secrets.token_hex(16)
+    now = int(time.time())
+
+    access = {
+        'type': ACCESS,
+        'sid': sid,
+        'uid': user.id,
+        'username': user.username,
+        'pid': profile.id,
+        'avatar_idx': profile.avatar_idx,
+        'role': profile.role,
+        'iat': now,
+        'exp': now + settings.JWT_VALIDATION_SECONDS,
+    }
+    refresh = {
+        'type': REFRESH,
+        'sid': sid,
+        'uid': user.id,
+        'pwd': password_fingerprint(user),
+        'iat': now,
+        'exp': now + settings.JWT_REFRESH_VALIDATION_SECONDS,
+    }
+
+    return {
+        'access_token': encode(access),
+        'refresh_token': encode(refresh),
+        'token_type': 'Bearer',
+        'expires_in': settings.JWT_VALIDATION_SECONDS,
+    }
+
+
+def revoke(claims: dict) -> bool:
+    """ Revokes the family of the token, False if it already was """
+    # Tokens of a family never outlive the refresh token issued with them
+    expires_at = datetime.fromtimestamp(claims['iat'] + settings.JWT_REFRESH_VALIDATION_SECONDS, tz=dt_timezone.utc)
+
+    _, created = RevokedToken.objects.get_or_create(sid=claims['sid'], defaults={'expires_at': expires_at})
+    denylist.add(claims['sid'])
+
+    return created
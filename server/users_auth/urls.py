@@ -4,8 +4,10 @@ from .views import *
 urlpatterns = [
     path('/check-auth', CheckAuth.as_view()),
     path('/register', Register.as_view()),
+    path('/availability', Availability.as_view()),
     path('/login', Login.as_view()),
     path('/logout', Logout.as_view()),
+    path('/token/refresh', RefreshToken.as_view()),
     path('/validate-link/account/<slug:otp_hash>', VerifyAccountOtpLink.as_view()),
     path('/verification/<slug:otp_hash>', AccountVerification.as_view()),
     path('/resend-otp/<slug:otp_hash>', ResendOtp.as_view()),
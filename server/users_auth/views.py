@@ -1,5 +1,5 @@
-from django.core.mail import send_mail
-from django.contrib.auth import authenticate, login, logout
+from django.conf import settings
+from django.contrib.auth import login, logout
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.utils.decorators import method_decorator
@@ -8,17 +8,31 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.exceptions import NotFound
 from common.decorators import login_required, body
-from common.exceptions import Conflict, Unauthorized, InternalServerError, InvalidOrExpired
+from common.exceptions import BadRequest, Conflict, Unauthorized, InternalServerError, InvalidOrExpired
+from common.payload_keys import issue_session_key
+from outbox.helpers import enqueue_mail
 from users.models import Profile
 from .models import UnverifiedAccount, ForgotPasswordLink
+from .authentication import get_token_claims
+from .availability import EMAIL, FIELDS, PHONE_NO, USERNAME, check, lookup
+from .hashing import MODEL_BACKEND, authenticate, check_password, make_password, set_password
+from .tokens import REFRESH, decode, issue_tokens, password_fingerprint, revoke, sessions_enabled, tokens_enabled
 from .helpers import generate_hash, generate_otp, generate_profile_tag, get_account_verification_link, get_account_verification_mail_message, get_forgot_password_link, get_forgot_password_mail_message
-import environ
-
-env = environ.Env()
-environ.Env.read_env()
 
 PASSWORD_MISMATCH_EXCEPTION_MESSAGE = "Password and confirm-password do not match."
 
+CONFLICT_MESSAGES = {
+    EMAIL: 'This email is already registered.',
+    USERNAME: 'This username is already taken.',
+    PHONE_NO: 'This phone number is already registered.',
+}
+
+# Registering again updates the unverified account, except for its hash and creation date
+UNVERIFIED_ACCOUNT_UPDATE_FIELDS = [
+    'otp', 'updated_at', 'expires_at', 'avatar_idx', 'first_name', 'last_name',
+    'institution', 'phone_no', 'email', 'username', 'password',
+]
+
 
 class CheckAuth(APIView):
     def get(self, request):
@@ -45,60 +59,50 @@ class Register(APIView):
         email = request.data['email']
         unverified_acc: UnverifiedAccount
 
+        otp_hash = generate_hash()
+
         try:
             with transaction.atomic():
-                self.verify_email(email)
-                self.verify_username(request.data['username'])
-                self.verify_phone(request.data['phone_no'])
+                # Verified and unverified accounts are checked with a single query
+                availability = lookup(
+                    email=email,
+                    username=request.data['username'],
+                    phone_no=request.data['phone_no'],
+                )
 
-                otp_generated = generate_otp()
+                for name in FIELDS:
+                    if name in availability.taken:
+                        raise Conflict(message=CONFLICT_MESSAGES[name])
 
-                unverified_acc = UnverifiedAccount.objects.filter(
-                    email=email).first()  # type: ignore
+                otp_generated = generate_otp()
 
-                if unverified_acc is None:
+                if availability.pending_hash is None:
                     unverified_acc = self.create_new_acc(
-                        request, otp_generated)
+                        request, otp_hash, otp_generated)
+                    unverified_acc.save()
                 else:
-                    unverified_acc = self.update_unverified_acc(
-                        request, unverified_acc, otp_generated)
+                    unverified_acc = self.create_new_acc(
+                        request, availability.pending_hash, otp_generated)
+                    unverified_acc.save(update_fields=UNVERIFIED_ACCOUNT_UPDATE_FIELDS)
 
-                unverified_acc.save()
+                mail = get_account_verification_mail_message(
+                    unverified_acc.first_name,
+                    otp_generated,
+                    get_account_verification_link(unverified_acc.hash)
+                )
+
+                enqueue_mail(
+                    subject='Welcome to Moksha 2024, NIT Agartala - Please verify your email',
+                    message=mail.text,
+                    html_message=mail.html,
+                    recipient_list=[email],
+                )
         except IntegrityError:
             raise InternalServerError()
 
-        send_mail(
-            subject='Welcome to Moksha 2024, NIT Agartala - Please verify your email',
-            message=get_account_verification_mail_message(
-                unverified_acc.first_name,
-                otp_generated,
-                get_account_verification_link(unverified_acc.hash)
-            ),
-            from_email=env('EMAIL_HOST_USER'),
-            recipient_list=[email],
-            fail_silently=False,
-        )
-
         return Response({'message': "Otp validation link has been sent to your email."}, 201)
 
-    def verify_email(self, email: str):
-        if User.objects.filter(email=email).exists():
-            raise Conflict(message='This email is already registered.')
-
-    def verify_username(self, username: str):
-        if User.objects.filter(username=username).exists():
-            raise Conflict(message='This username is already taken.')
-
-    def verify_phone(self, phone_no: str):
-        if Profile.objects.filter(phone_no=phone_no).exists():
-            raise Conflict(message='This phone number is already registered.')
-
-    def create_new_acc(self, request, otp_generated: int) -> UnverifiedAccount:
-        otp_hash = generate_hash()
-
-        while UnverifiedAccount.objects.filter(hash=otp_hash).exists():
-            otp_hash = generate_hash()
-
+    def create_new_acc(self, request, otp_hash: str, otp_generated: int) -> UnverifiedAccount:
         new_account = UnverifiedAccount(
             hash=otp_hash,
             otp=otp_generated,
@@ -114,18 +118,20 @@ class Register(APIView):
 
         return new_account
 
-    def update_unverified_acc(self, request, unverified_acc: UnverifiedAccount, otp_generated: int) -> UnverifiedAccount:
 
-        unverified_acc.otp = otp_generated
-        unverified_acc.avatar_idx = request.data['avatar_idx']
-        unverified_acc.first_name = request.data['first_name']
-        unverified_acc.last_name = request.data['last_name']
-        unverified_acc.institution = request.data['institution']
-        unverified_acc.phone_no = request.data['phone_no']
-        unverified_acc.username = request.data['username']
-        unverified_acc.password = request.data['password']
+class Availability(APIView):
+    # Live checks for the signup form, same rules as Register
+    def get(self, request):
+        values = {
+            name: request.GET[name]
+            for name in FIELDS
+            if request.GET.get(name)
+        }
 
-        return unverified_acc
+        if not values:
+            raise BadRequest(message='Provide an email, username or phone_no to check.')
+
+        return Response(data=check(values))
 
 
 class Login(APIView):
@@ -139,23 +145,62 @@ class Login(APIView):
         if abstract_user is None:
             raise Unauthorized(message='Invalid username or password.')
 
-        login(request, abstract_user)
+        if sessions_enabled():
+            login(request, abstract_user)
 
         user = User.objects.get(id=abstract_user.pk)
+        data = {'user_id': user.id, 'avatar_idx': user.profile.avatar_idx}
 
-        return Response(data={'user_id': user.id, 'avatar_idx': user.profile.avatar_idx})
+        # Payload keys are stored in the session
+        if settings.PAYLOAD_SESSION_KEYS and sessions_enabled():
+            data.update(issue_session_key(request))
+
+        if tokens_enabled():
+            data.update(issue_tokens(user, user.profile))
+
+        return Response(data=data)
 
 
 class Logout(APIView):
     def get(self, request):
+        claims = get_token_claims(request)
+
+        if claims is not None:
+            revoke(claims)
+
         logout(request)
         return Response(data={'message': 'User has been successfully logged out.'}, status=200)
 
 
+class RefreshToken(APIView):
+    @body({'refresh_token'})
+    def post(self, request):
+        if not tokens_enabled():
+            raise NotFound({'message': 'Token authentication is disabled.'})
+
+        claims = decode(request.data['refresh_token'], REFRESH)
+
+        if claims is None:
+            raise Unauthorized(message='Invalid or expired token.')
+
+        user = User.objects.select_related('profile').filter(
+            id=claims['uid'], is_active=True).first()
+
+        # Password changes invalidate refresh tokens
+        if user is None or claims.get('pwd') != password_fingerprint(user):
+            raise Unauthorized(message='Invalid or expired token.')
+
+        # Rotate: the old family is revoked, a token can only be refreshed once
+        if not revoke(claims):
+            raise Unauthorized(message='Invalid or expired token.')
+
+        return Response(data=issue_tokens(user, user.profile))
+
+
 class VerifyAccountOtpLink(APIView):
     # Check if account verification link is valid or not
     def get(self, request, otp_hash):
-        if UnverifiedAccount.objects.filter(hash=otp_hash).exists():
+        if UnverifiedAccount.objects.active().filter(hash=otp_hash).exists():
             return Response({'valid': True}, status=200)
 
         return Response({'valid': False}, status=200)
@@ -164,33 +209,34 @@ class VerifyAccountOtpLink(APIView):
 class AccountVerification(APIView):
     @body({'otp'})
     def post(self, request, otp_hash):
-        try:
-            with transaction.atomic():
-                unverified_acc = UnverifiedAccount.objects.filter(
-                    hash=otp_hash).first()
-
-                if unverified_acc is None:
-                    return InvalidOrExpired(message='Invalid link.')
+        unverified_acc = UnverifiedAccount.objects.filter(
+            hash=otp_hash).first()
 
-                self.verify_otp_age(unverified_acc)
+        if unverified_acc is None:
+            raise InvalidOrExpired(message='Invalid link.')
 
-                otp = int(request.data['otp'])
+        if unverified_acc.expires_at <= timezone.now():
+            raise InvalidOrExpired(message='OTP has expired.')
 
-                if unverified_acc.otp != otp:
-                    raise Unauthorized(message='Invalid OTP.')
+        otp = int(request.data['otp'])
 
-                new_tag = generate_profile_tag()
+        if unverified_acc.otp != otp:
+            raise Unauthorized(message='Invalid OTP.')
 
-                while Profile.objects.filter(tag=new_tag).exists():
-                    new_tag = generate_profile_tag()
+        # Only for accepted OTPs, and outside of the transaction so that tags are reserved by blocks
+        new_tag = generate_profile_tag()
 
-                new_user = User.objects.create_user(
-                    email=unverified_acc.email,
+        try:
+            with transaction.atomic():
+                # Same as create_user(), with the password hashed on the hashing pool
+                new_user = User(
+                    email=User.objects.normalize_email(unverified_acc.email),
                     first_name=unverified_acc.first_name,
                     last_name=unverified_acc.last_name,
-                    username=unverified_acc.username,
-                    password=unverified_acc.password,
+                    username=User.normalize_username(unverified_acc.username),
+                    password=make_password(unverified_acc.password),
                 )
+                new_user.save()
 
                 new_profile = Profile(
                     user=new_user,
@@ -207,12 +253,6 @@ class AccountVerification(APIView):
 
         return Response({'message': 'Account verification successful.'})
 
-    def verify_otp_age(self, unverified_acc: UnverifiedAccount):
-        otp_age = timezone.now() - unverified_acc.updated_at
-
-        if otp_age.seconds > int(env('OTP_VALIDATION_SECONDS')):
-            raise InvalidOrExpired(message='OTP has expired.')
-
 
 class ResendOtp(APIView):
     def get(self, request, otp_hash):
@@ -222,21 +262,23 @@ class ResendOtp(APIView):
         if unverified_acc is None:
             raise NotFound({'message': 'Invalid link.'})
 
-        unverified_acc.otp = generate_otp()
-        unverified_acc.save()
+        with transaction.atomic():
+            unverified_acc.otp = generate_otp()
+            unverified_acc.save()
 
-        send_mail(
-            subject='Moksha 2024, NIT Agartala - New OTP for account verification',
-            message=get_account_verification_mail_message(
+            mail = get_account_verification_mail_message(
                 unverified_acc.first_name,
                 unverified_acc.otp,
                 get_account_verification_link(otp_hash),
                 False
-            ),
-            from_email=env('EMAIL_HOST_USER'),
-            recipient_list=[unverified_acc.email],
-            fail_silently=False,
-        )
+            )
+
+            enqueue_mail(
+                subject='Moksha 2024, NIT Agartala - New OTP for account verification',
+                message=mail.text,
+                html_message=mail.html,
+                recipient_list=[unverified_acc.email],
+            )
 
         return Response({'message': 'An email has been sent with the new OTP.'}, status=200)
 
@@ -254,22 +296,23 @@ class ResendVerificationLink(APIView):
                 unverified_acc = self.get_unverified_acc(email)
                 unverified_acc.otp = generate_otp()
                 unverified_acc.save()
+
+                mail = get_account_verification_mail_message(
+                    unverified_acc.first_name,
+                    unverified_acc.otp,
+                    get_account_verification_link(unverified_acc.hash),
+                    False
+                )
+
+                enqueue_mail(
+                    subject='Moksha 2024, NIT Agartala - New OTP for account verification',
+                    message=mail.text,
+                    html_message=mail.html,
+                    recipient_list=[unverified_acc.email],
+                )
         except IntegrityError:
             raise InternalServerError()
 
-        send_mail(
-            subject='Moksha 2024, NIT Agartala - New OTP for account verification',
-            message=get_account_verification_mail_message(
-                unverified_acc.first_name,
-                unverified_acc.otp,
-                get_account_verification_link(unverified_acc.hash),
-                False
-            ),
-            from_email=env('EMAIL_HOST_USER'),
-            recipient_list=[unverified_acc.email],
-            fail_silently=False,
-        )
-
         return Response({'message': 'An email has been sent with the new OTP.'}, status=200)
 
     def get_unverified_acc(self, email) -> UnverifiedAccount:
@@ -283,18 +326,10 @@ class ResendVerificationLink(APIView):
 
 class VerifyResetPassLink(APIView):
     def get(self, request, forgot_pass_hash):
-        forgot_pass_entry = ForgotPasswordLink.objects.filter(
-            hash=forgot_pass_hash).first()
-
-        if forgot_pass_entry is None:
-            return Response({'valid': False}, status=200)
-
-        link_age = timezone.now() - forgot_pass_entry.updated_at
-
-        if link_age.seconds > int(env('FORGOT_PASS_VALIDATION_SECONDS')):
-            return Response({'valid': False}, status=200)
+        if ForgotPasswordLink.objects.active().filter(hash=forgot_pass_hash).exists():
+            return Response({'valid': True}, status=200)
 
-        return Response({'valid': True}, status=200)
+        return Response({'valid': False}, status=200)
 
 
 class ForgotPassword(APIView):
@@ -302,6 +337,8 @@ class ForgotPassword(APIView):
     def post(self, request):
         email = request.data['email']
 
+        forgot_pass_hash = generate_hash()
+
         try:
             with transaction.atomic():
                 user = User.objects.filter(email=email).first()
@@ -316,24 +353,24 @@ class ForgotPassword(APIView):
                 if forgot_pass_entry is not None:
                     forgot_pass_entry.delete()
 
-                forgot_pass_hash = generate_hash()
                 forgot_pass_entry = ForgotPasswordLink(
                     hash=forgot_pass_hash, user=user)
                 forgot_pass_entry.save()
+
+                mail = get_forgot_password_mail_message(
+                    user,
+                    get_forgot_password_link(forgot_pass_hash)
+                )
+
+                enqueue_mail(
+                    subject='Moksha 2024, NIT Agartala - Reset Password',
+                    message=mail.text,
+                    html_message=mail.html,
+                    recipient_list=[email],
+                )
         except IntegrityError:
             raise InternalServerError()
 
-        send_mail(
-            subject='Moksha 2024, NIT Agartala - Reset Password',
-            message=get_forgot_password_mail_message(
-                user,
-                get_forgot_password_link(forgot_pass_hash)
-            ),
-            from_email=env('EMAIL_HOST_USER'),
-            recipient_list=[email],
-            fail_silently=False,
-        )
-
         return Response({'message': "Reset password link has been sent to your email."}, status=201)
 
 
@@ -352,10 +389,11 @@ class ResetPassword(APIView):
                 except ForgotPasswordLink.DoesNotExist:
                     raise NotFound({'message': 'Invalid link.'})
 
-                self.verify_link_age(forgot_pass_entry)
+                if forgot_pass_entry.expires_at <= timezone.now():
+                    raise InvalidOrExpired(message='Link has expired.')
 
                 user = forgot_pass_entry.user
-                user.set_password(request.data['password'])
+                set_password(user, request.data['password'])
                 user.save()
                 forgot_pass_entry.delete()
         except IntegrityError:
@@ -363,12 +401,6 @@ class ResetPassword(APIView):
 
         return Response({'message': 'Your password has been reset.'})
 
-    def verify_link_age(self, forgot_pass_entry: ForgotPasswordLink):
-        link_age = timezone.now() - forgot_pass_entry.updated_at
-
-        if link_age.seconds > int(env('FORGOT_PASS_VALIDATION_SECONDS')):
-            raise InvalidOrExpired(message='Link has expired.')
-
 
 @method_decorator(login_required, name="dispatch")
 class ChangePassword(APIView):
@@ -386,22 +418,24 @@ class ChangePassword(APIView):
 
         try:
             with transaction.atomic():
-                abstract_user = authenticate(
-                    request, username=user.username, password=request.data['old_password'])
-
-                if abstract_user is None:
+                if not check_password(user, request.data['old_password']):
                     raise Unauthorized(
                         message="Old password does not match with your current password.")
 
-                user.set_password(request.data['new_password'])
+                set_password(user, request.data['new_password'])
                 user.save()
         except IntegrityError:
             raise InternalServerError()
 
-        # Login the user again to create a new session
-        abstract_user = authenticate(
-            request, username=user.username, password=request.data['new_password'])
+        data = {'message': 'Your password has been updated.'}
+        claims = get_token_claims(request)
 
-        login(request, abstract_user)
+        if claims is not None:
+            # Refresh tokens of the old password are rejected anyway, hand out new ones
+            revoke(claims)
+            data.update(issue_tokens(user, user.profile))
+        else:
+            # Login the user again to create a new session, the new hash is already known
+            login(request, user, backend=MODEL_BACKEND)
 
-        return Response(data={'message': 'Your password has been updated.'})
+        return Response(data=data)